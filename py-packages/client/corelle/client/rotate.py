@@ -2,32 +2,39 @@
 This mini-module is essentially the equivalent of the Javascript `@macrostrat/corelle`
 library, for rotating plates provided by a Corelle rotations server.
 """
-import sys
-import os
-from collections.abc import Iterable
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
 
 import numpy as N
 import quaternion as Q
-from shapely.ops import transform
+import shapely
 from shapely.geometry import shape
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
 from corelle.math import cart2sph, sph2cart
 
 
 def rotate_point(q, point):
-    if isinstance(point[0], Iterable):
-        raise TypeError("Function is not vectorized")
-        return point
-    v0 = sph2cart(*point)
+    """Rotate a (lon, lat) point, or an (n, 2) array of points, by a quaternion"""
+    points = N.asarray(point, dtype=float)
     q = N.quaternion(*q)
-    v1 = Q.rotate_vectors(q, v0)
-    return cart2sph(v1)
+    if points.ndim == 1:
+        v0 = sph2cart(*points)
+        v1 = Q.rotate_vectors(q, v0)
+        return cart2sph(v1)
+    v0 = sph2cart(points[:, 0], points[:, 1])
+    v1 = Q.rotate_vectors(q, v0.T)
+    return N.column_stack(cart2sph(v1.T))
 
 
 def rotate_geometry(q, geometry):
-    """Rotate a geometry by a quaternion"""
-    return transform(lambda x, y: rotate_point(q, (x, y)), geometry)
+    """Rotate a geometry, or an array of geometries, by a quaternion.
+
+    All vertices are rotated together in a single vectorized operation.
+    Z coordinates are dropped, so rotated geometries are two-dimensional.
+    """
+    return shapely.transform(geometry, lambda coords: rotate_point(q, coords))
 
 
 def rotate_features(
@@ -36,25 +43,107 @@ def rotate_features(
     """Rotate features by a set of instantaneous rotations"""
     rot_index = {v["plate_id"]: v["quaternion"] for v in rotations}
 
-    for f in features:
-        q = rot_index.get(plate_id(f))
+    # Group features by plate so that each plate's geometries
+    # can be rotated together
+    groups = defaultdict(list)
+    for ix, f in enumerate(features):
+        groups[plate_id(f)].append((ix, f))
+
+    rotated = {}
+    for key, group in groups.items():
+        q = rot_index.get(key)
         if q is None:
             continue
-        yield rotate_geometry(q, shape(f["geometry"]))
+        geoms = N.array([shape(f["geometry"]) for _, f in group], dtype=object)
+        for (ix, _), geom in zip(group, rotate_geometry(q, geoms)):
+            rotated[ix] = geom
 
+    for ix in sorted(rotated):
+        yield rotated[ix]
 
-def rotate_dataframe(df, rotations, time=None):
-    """Rotate a GeoPandas GeoDataFrame. This function expects a
-    quaternion and geometry column."""
 
-    def rotate_row(row):
-        # This bit actually does the rotation
-        return rotate_geometry(row.quaternion, row.geometry)
-
-    rot = DataFrame.from_dict(rotations)
-    if time is not None:
-        rot["time"] = time
+def _rotate_frame(df, rot):
+    """Rotate the geometries of a frame, grouped by plate"""
     res = df.merge(rot, on="plate_id")
-    res["geometry"] = res.apply(rotate_row, axis=1)
+    geoms = N.asarray(res["geometry"], dtype=object)
+    rotated = N.empty(len(res), dtype=object)
+    for ix in res.groupby("plate_id").indices.values():
+        q = res["quaternion"].iat[ix[0]]
+        rotated[ix] = rotate_geometry(q, geoms[ix])
+    res["geometry"] = rotated
     res.drop(columns=["quaternion"], inplace=True)
     return res
+
+
+def read_rotations(data):
+    """Decode rotations sent in binary form (`format=npy`) by the
+    `/api/rotate` and `/api/rotate-series` endpoints.
+
+    Returns a structured array with `time`, `plate_id` and `quaternion`
+    fields, which can be passed to `rotate_features` or `rotate_dataframe`
+    in place of JSON rotations.
+    """
+    return N.load(BytesIO(data), allow_pickle=False)
+
+
+def _rotation_sets(rotations, time=None):
+    """Normalize rotations to a list of (time, rotations) pairs"""
+    if isinstance(rotations, dict):
+        return list(rotations.items())
+    if isinstance(rotations, N.ndarray):
+        # Output of `read_rotations`, which may contain several times
+        return [
+            (t, _rotation_records(rotations[rotations["time"] == t]))
+            for t in N.unique(rotations["time"]).tolist()
+        ]
+    rotations = list(rotations)
+    if len(rotations) > 0 and "rotations" in rotations[0]:
+        # Output of the `/api/rotate-series` endpoint
+        return [(r["time"], r["rotations"]) for r in rotations]
+    return [(time, rotations)]
+
+
+def _rotation_records(rotations):
+    return [
+        dict(plate_id=plate_id, quaternion=q)
+        for plate_id, q in zip(
+            rotations["plate_id"].tolist(), rotations["quaternion"].tolist()
+        )
+    ]
+
+
+def rotate_dataframe(df, rotations, time=None, chunk_size=None, processes=None):
+    """Rotate a GeoPandas GeoDataFrame. This function expects a
+    plate_id and geometry column.
+
+    `rotations` is a list of records with `plate_id` and `quaternion` fields
+    (as returned by `/api/rotate?quaternion=true`), or an array decoded by
+    `read_rotations`. To reconstruct the frame at several times at once, pass
+    a mapping of times to rotations, the output of `/api/rotate-series`, or a
+    decoded series; the results for each time are concatenated, with a `time`
+    column.
+
+    Rows are rotated in groups that share a plate. Large frames can be split
+    into chunks of `chunk_size` rows, which are rotated in parallel across
+    `processes` worker processes.
+    """
+    tasks = []
+    for t, _rotations in _rotation_sets(rotations, time):
+        rot = DataFrame.from_dict(_rotations)
+        if t is not None:
+            rot["time"] = t
+        if chunk_size is None:
+            tasks.append((df, rot))
+            continue
+        for start in range(0, len(df), chunk_size):
+            tasks.append((df.iloc[start : start + chunk_size], rot))
+
+    if processes is not None and processes > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            frames = list(executor.map(_rotate_frame, *zip(*tasks)))
+    else:
+        frames = [_rotate_frame(*task) for task in tasks]
+
+    if len(frames) == 1:
+        return frames[0]
+    return concat(frames, ignore_index=True)
@@ -0,0 +1,104 @@
+"""
+Tests of rotating points, geometries and data frames with the client.
+"""
+import numpy as N
+from geopandas import GeoDataFrame
+from shapely.geometry import MultiPolygon, Point, Polygon
+
+from corelle.math import euler_to_quaternion
+from corelle.client.rotate import rotate_dataframe, rotate_geometry, rotate_point
+
+_q = [*euler_to_quaternion([40, 60, 25]).components]
+
+
+def test_rotate_points():
+    """Rotating an array of points should match rotating them one at a time"""
+    points = N.array([[0, 0], [10, 20], [-120, 45], [179, -89]])
+    res = rotate_point(_q, points)
+    assert res.shape == points.shape
+    for point, rotated in zip(points, res):
+        assert N.allclose(rotate_point(_q, point), rotated)
+
+
+def test_rotate_geometry():
+    square = Polygon([(0, 0), (10, 0), (10, 10), (0, 10)])
+    triangle = Polygon([(20, 20), (30, 20), (25, 30)])
+    for geom in [square, MultiPolygon([square, triangle])]:
+        rotated = rotate_geometry(_q, geom)
+        assert rotated.geom_type == geom.geom_type
+        coords = N.array(
+            [c for g in getattr(geom, "geoms", [geom]) for c in g.exterior.coords]
+        )
+        expected = rotate_point(_q, coords)
+        res = N.array(
+            [c for g in getattr(rotated, "geoms", [rotated]) for c in g.exterior.coords]
+        )
+        assert N.allclose(res, expected)
+
+    # Arrays of geometries are rotated together
+    res = rotate_geometry(_q, N.array([square, triangle], dtype=object))
+    assert res[1].equals_exact(rotate_geometry(_q, triangle), 1e-9)
+
+    # Z coordinates are dropped
+    assert not rotate_geometry(_q, Point(10, 20, 5)).has_z
+
+
+def _rotations(angle):
+    return [
+        dict(
+            plate_id=plate_id,
+            quaternion=[*euler_to_quaternion([0, 90, angle * plate_id]).components],
+        )
+        for plate_id in (1, 2)
+    ]
+
+
+frame = GeoDataFrame(
+    dict(plate_id=[2, 1, 3, 1, 2]),
+    geometry=[Point(i * 10, i * 5) for i in range(5)],
+)
+
+
+def test_rotate_dataframe_series():
+    """Frames are reconstructed to several times in order, with a `time` column"""
+    series = [dict(time=t, rotations=_rotations(t)) for t in (10, 20)]
+    res = rotate_dataframe(frame, series)
+    # Rows on plates without a rotation are dropped
+    assert res["time"].tolist() == [10] * 4 + [20] * 4
+    assert res["plate_id"].tolist() == [2, 1, 1, 2] * 2
+
+    for t, rotations in [(10, _rotations(10)), (20, _rotations(20))]:
+        single = rotate_dataframe(frame, rotations)
+        assert "time" not in single
+        rows = res[res["time"] == t].reset_index(drop=True)
+        assert all(
+            a.equals_exact(b, 1e-9) for a, b in zip(rows.geometry, single.geometry)
+        )
+
+    # Other forms of multi-time input give the same result
+    mapping = rotate_dataframe(frame, {t: _rotations(t) for t in (10, 20)})
+    assert mapping["time"].tolist() == res["time"].tolist()
+    records = N.array(
+        [
+            (r["time"], p["plate_id"], p["quaternion"])
+            for r in series
+            for p in r["rotations"]
+        ],
+        dtype=[("time", "<f8"), ("plate_id", "<i4"), ("quaternion", "<f8", 4)],
+    )
+    binary = rotate_dataframe(frame, records)
+    assert binary["time"].tolist() == res["time"].tolist()
+    assert all(a.equals_exact(b, 1e-9) for a, b in zip(binary.geometry, res.geometry))
+
+
+def test_rotate_dataframe_chunks():
+    """Chunked and parallel rotation gives the same results as a single pass"""
+    series = [dict(time=t, rotations=_rotations(t)) for t in (10, 20)]
+    expected = rotate_dataframe(frame, series)
+    for kwargs in [dict(chunk_size=2), dict(chunk_size=2, processes=2)]:
+        res = rotate_dataframe(frame, series, **kwargs)
+        assert res["time"].tolist() == expected["time"].tolist()
+        assert res["plate_id"].tolist() == expected["plate_id"].tolist()
+        assert all(
+            a.equals_exact(b, 1e-9) for a, b in zip(res.geometry, expected.geometry)
+        )
@@ -6,5 +6,6 @@ def vector(*args):
 
 
 def unit_vector(*args):
+    """Normalize a vector, or an array of vectors stacked along the first axis"""
     v = vector(*args)
-    return v / N.linalg.norm(v)
+    return v / N.linalg.norm(v, axis=0)
@@ -3,25 +3,104 @@ Mapped database models. These would ideally be in the database module, but
 they need to be here to avoid initialization issues.
 """
 
+import gzip
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import StringIO
+
 from sqlalchemy.sql import select
 
-from rich.progress import Progress
-from sqlalchemy.dialects.postgresql import insert
+from rich.progress import Progress, TextColumn
 from sqlalchemy.sql import text
 import numpy as N
+import quaternion as Q
 
 from corelle.math import quaternion_to_euler
-from .storage import _model, _rotation_cache, conn, model_id
-from .rotate import get_rotation_series
+from .storage import _model, _rotation_cache, bump_model_version, conn, model_id
+from .model import get_rotation_model, _models
 from .database import db
 from .query import get_sql
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 update_derived = get_sql("update-cache")
+__cached_rotations = get_sql("cached-rotations-for-time")
+
+__delete_sql = "DELETE FROM corelle.rotation_cache WHERE model_id = %(model_id)s"
+__copy_sql = """
+COPY corelle.rotation_cache (model_id, plate_id, t_step, rotation) FROM STDIN
+"""
+__cached_steps = text(
+    "SELECT DISTINCT t_step FROM corelle.rotation_cache "
+    "WHERE model_id = :model_id ORDER BY t_step"
+)
+__reconstruct_plates = get_sql("reconstruct-plate-polygons")
+__reconstruct_features = get_sql("reconstruct-features")
+__delete_reconstructions = text(
+    "DELETE FROM corelle.reconstruction_cache "
+    "WHERE model_id = :model_id AND NOT t_step = ANY(:t_steps)"
+)
+__uncompressed_plates = text(
+    """
+    SELECT c.model_id, c.geojson::text
+    FROM corelle.plate_polygon_cache c
+    LEFT JOIN corelle.plate_polygon_payload p
+      ON p.model_id = c.model_id
+    WHERE c.model_id = ANY(:model_ids)
+      AND (p.geojson_gzip IS NULL OR :overwrite)
+    """
+)
+__store_plates_payload = text(
+    """
+    INSERT INTO corelle.plate_polygon_payload (model_id, geojson_gzip, geojson_br)
+    VALUES (:model_id, :geojson_gzip, :geojson_br)
+    ON CONFLICT (model_id) DO UPDATE SET
+      geojson_gzip = EXCLUDED.geojson_gzip,
+      geojson_br = EXCLUDED.geojson_br
+    """
+)
+__uncompressed_reconstructions = text(
+    """
+    SELECT model_id, layer, dataset_id, t_step
+    FROM corelle.reconstruction_cache
+    WHERE model_id = ANY(:model_ids)
+      AND (geojson_gzip IS NULL OR :overwrite)
+    """
+)
+__reconstruction_payload = text(
+    """
+    SELECT geojson::text
+    FROM corelle.reconstruction_cache
+    WHERE model_id = :model_id
+      AND layer = :layer
+      AND dataset_id = :dataset_id
+      AND t_step = :t_step
+    """
+)
+__store_reconstruction_payload = text(
+    """
+    UPDATE corelle.reconstruction_cache
+    SET geojson_gzip = :geojson_gzip, geojson_br = :geojson_br
+    WHERE model_id = :model_id
+      AND layer = :layer
+      AND dataset_id = :dataset_id
+      AND t_step = :t_step
+    """
+)
+__delete_interval_sql = """
+DELETE FROM corelle.rotation_cache
+WHERE model_id = %(model_id)s
+  AND plate_id = %(plate_id)s
+  AND t_step BETWEEN %(lo)s AND %(hi)s
+"""
 
 
 def get_from_cache(cache_args):
     # Get a rotation from the database cache
-    (model_name, plate_id, time) = cache_args
+    model_name, plate_id, time = cache_args
 
     tbl = _rotation_cache.join(_model, _model.c.id == _rotation_cache.c.model_id)
     res = conn.execute(
@@ -36,66 +115,446 @@ def get_from_cache(cache_args):
     return None
 
 
-def build_rotation_caches():
-    # Truncate the rotation cache
-    conn.execute(_rotation_cache.delete())
-    # Get the list of models
+def cached_rotations(model_name, time, tolerance=1):
+    """Get rotations for all cached plates at a time with one bulk query.
+
+    Times between cached steps are interpolated from the neighbouring
+    cached rotations, as long as the steps are no more than `tolerance`
+    Myr apart.
+
+    Returns
+    -------
+    dict of plate ID to quaternion. Plates without cached rotations on
+    both sides of the time are omitted.
+    """
+    time = float(time)
+    rows = conn.execute(
+        __cached_rotations,
+        dict(model_name=model_name, time=time, tolerance=tolerance),
+    ).fetchall()
+    plate_id = N.array([r.plate_id for r in rows], dtype=int)
+    t_step = N.array([float(r.t_step) for r in rows])
+    q = Q.as_quat_array(N.array([r.rotation for r in rows], dtype=float).reshape(-1, 4))
+
+    res = {}
+    exact = t_step == time
+    for i in N.nonzero(exact)[0]:
+        res[int(plate_id[i])] = q[i]
+    # Rows are sorted by plate and time, so the steps on either side of
+    # the time are adjacent
+    pair = (plate_id[1:] == plate_id[:-1]) & ~exact[:-1]
+    i = N.nonzero(pair)[0]
+    if len(i) > 0:
+        q_interp = Q.slerp(q[i], q[i + 1], t_step[i], t_step[i + 1], time)
+        res.update(zip(plate_id[i].tolist(), q_interp))
+    return res
+
+
+def _model_time_steps(model, time_step=1):
+    min_age = model.min_age or 0
+    max_age = model.max_age or 1000
+    return list(range(int(min_age), int(max_age) + 1, time_step))
+
+
+def _format_row(model_id, plate_id, t_step, q):
+    """A row of the rotation cache in PostgreSQL's COPY text format"""
+    rotation = ",".join(repr(float(c)) for c in (q.w, q.x, q.y, q.z))
+    return f"{model_id}\t{plate_id}\t{t_step!r}\t{{{rotation}}}\n"
+
+
+def format_rotations(model_id, rotations):
+    """Rows of a rotation series in PostgreSQL's COPY text format.
+
+    Returns the rows as a string, and the number of rows.
+    """
+    buffer = StringIO()
+    count = 0
+    for tstep in rotations:
+        t_step = float(tstep["time"])
+        for plate_id, q in tstep["rotations"]:
+            if q is None:
+                continue
+            buffer.write(_format_row(model_id, plate_id, t_step, q))
+            count += 1
+    return buffer.getvalue(), count
+
+
+def copy_rotations(model_id, rotations, connection=None):
+    """Stream a rotation series into the cache with a single COPY.
+
+    If a (raw) connection is given, the rows are written in its current
+    transaction, which the caller commits. Returns the number of rows written.
+    """
+    rows, count = format_rotations(model_id, rotations)
+    raw = connection or db.engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.copy_expert(__copy_sql, StringIO(rows))
+        if connection is None:
+            raw.commit()
+    finally:
+        if connection is None:
+            raw.close()
+    return count
+
+
+def _init_worker(models):
+    _models.update(models)
+
+
+def _format_time_steps(model_name, model_id, times):
+    rotations = get_rotation_model(model_name).get_rotation_series(*times)
+    return (model_name, len(times), *format_rotations(model_id, rotations))
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def build_rotation_caches(model_names=None, time_step=1, processes=None, chunk_size=25):
+    """Cache rotations for models (by default, all models).
+
+    Time steps are split into chunks that are computed in parallel across a
+    process pool. Rows are written (using COPY) in a single transaction that
+    also removes the models' previous rows, so servers keep reading the old
+    cache until the rebuild is complete, and a failed rebuild leaves it intact.
+    """
     models = conn.execute(_model.select()).fetchall()
+    if model_names is not None:
+        models = [m for m in models if m.name in model_names]
+
+    # Models are loaded before starting the pool, and shared with each worker
+    loaded = {m.name: get_rotation_model(m.name) for m in models}
+
+    columns = [
+        *Progress.get_default_columns(),
+        TextColumn("{task.fields[rows]} rows ({task.fields[rate]:.0f}/s)"),
+    ]
+    start = time.perf_counter()
+    total_rows = 0
+    raw = db.engine.raw_connection()
+    try:
+        with raw.cursor() as cursor, Progress(*columns) as progress:
+            for model in models:
+                cursor.execute(__delete_sql, dict(model_id=model.id))
+
+            tasks = {}
+            futures = []
+            with ProcessPoolExecutor(
+                max_workers=processes, initializer=_init_worker, initargs=(loaded,)
+            ) as executor:
+                for model in models:
+                    t_steps = _model_time_steps(model, time_step)
+                    tasks[model.name] = progress.add_task(
+                        model.name, total=len(t_steps), rows=0, rate=0
+                    )
+                    for chunk in _chunks(t_steps, chunk_size):
+                        futures.append(
+                            executor.submit(
+                                _format_time_steps, model.name, model.id, chunk
+                            )
+                        )
 
+                rows = {m.name: 0 for m in models}
+                for future in as_completed(futures):
+                    model_name, n_steps, chunk_rows, n_rows = future.result()
+                    cursor.copy_expert(__copy_sql, StringIO(chunk_rows))
+                    rows[model_name] += n_rows
+                    total_rows += n_rows
+                    elapsed = time.perf_counter() - start
+                    progress.update(
+                        tasks[model_name],
+                        advance=n_steps,
+                        rows=rows[model_name],
+                        rate=rows[model_name] / elapsed,
+                    )
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+    # Served rotations have changed
     for model in models:
-        build_rotation_cache(model)
+        bump_model_version(model.id)
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Cached {total_rows} rotations for {len(models)} models "
+        f"in {elapsed:.1f} s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)"
+    )
+    return total_rows
 
 
 def build_rotation_cache(model, time_step=1):
-    # Get the time span of the model
+    """Cache rotations for a single model, without a process pool. The model's
+    previous rows are replaced in a single transaction."""
+    t_steps = _model_time_steps(model, time_step)
+    rotations = get_rotation_model(model.name).get_rotation_series(*t_steps)
 
-    min_age = model.min_age or 0
-    max_age = model.max_age or 1000
+    raw = db.engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.execute(__delete_sql, dict(model_id=model.id))
+        count = copy_rotations(model.id, rotations, connection=raw)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    bump_model_version(model.id)
+    return count
+
+
+def _merge_intervals(intervals):
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(hi, merged[-1][1]))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def changed_intervals(old_rotations, new_rotations):
+    """Find the time intervals over which each plate's rotation may have
+    changed between two sets of `corelle.rotation` rows.
+
+    A changed, added or removed step affects its plate between the
+    neighbouring steps of the same plate/reference-plate sequence (before
+    or after the change). Changes are then propagated to every plate that
+    rotates relative to an affected plate, over the same interval.
+
+    Returns
+    -------
+    dict of plate ID to a list of (young, old) time intervals
+    """
+
+    def poles(rows):
+        return {
+            (r.plate_id, r.ref_plate_id, float(r.t_step)): (
+                r.latitude,
+                r.longitude,
+                r.angle,
+            )
+            for r in rows
+        }
+
+    old, new = poles(old_rotations), poles(new_rotations)
+    keys = old.keys() | new.keys()
 
-    # Get model steps every 1 Myr
-    t_steps = list(range(int(min_age), int(max_age) + 1, time_step))
+    steps = {}
+    children = {}
+    for plate_id, ref_plate_id, t_step in keys:
+        steps.setdefault((plate_id, ref_plate_id), set()).add(t_step)
+        children.setdefault(ref_plate_id, set()).add(plate_id)
+    steps = {k: sorted(v) for k, v in steps.items()}
 
-    session = db.session()
+    intervals = {}
+    for key in keys:
+        if old.get(key) == new.get(key):
+            continue
+        plate_id, ref_plate_id, t_step = key
+        _steps = steps[(plate_id, ref_plate_id)]
+        i = _steps.index(t_step)
+        lo = _steps[i - 1] if i > 0 else t_step
+        hi = _steps[i + 1] if i < len(_steps) - 1 else t_step
+        intervals.setdefault(plate_id, []).append((lo, hi))
+    intervals = {k: _merge_intervals(v) for k, v in intervals.items()}
 
-    session.execute(
-        text("DELETE FROM corelle.rotation_cache WHERE model_id = :model_id"),
-        dict(model_id=model.id),
+    # Descendants in the plate tree are affected over the same intervals
+    queue = list(intervals)
+    while queue:
+        plate_id = queue.pop()
+        for child in children.get(plate_id, ()):
+            current = intervals.get(child, [])
+            merged = _merge_intervals(current + intervals[plate_id])
+            if merged != current:
+                intervals[child] = merged
+                queue.append(child)
+    return intervals
+
+
+def refresh_rotation_cache(model_name, intervals):
+    """Recompute cached rotations for plates over the given time intervals.
+
+    Only time steps that are already in the cache are refreshed.
+
+    Returns the number of rows written.
+    """
+    model = conn.execute(_model.select().where(_model.c.name == model_name)).first()
+    t_steps = N.array(
+        [float(r[0]) for r in conn.execute(__cached_steps, dict(model_id=model.id))]
     )
-    session.commit()
+    if len(t_steps) == 0 or not intervals:
+        return 0
 
-    rotations = get_rotation_series(model.name, *t_steps)
+    # Affected plates at each cached time step
+    affected = {}
+    deletions = []
+    for plate_id, _intervals in intervals.items():
+        for lo, hi in _intervals:
+            lo, hi = max(lo, t_steps[0]), min(hi, t_steps[-1])
+            if lo > hi:
+                continue
+            deletions.append(dict(model_id=model.id, plate_id=plate_id, lo=lo, hi=hi))
+            for t in t_steps[(t_steps >= lo) & (t_steps <= hi)].tolist():
+                affected.setdefault(t, set()).add(plate_id)
+    if not affected:
+        return 0
+
+    rotation_model = get_rotation_model(model_name, reload=True)
+    rotations = (
+        dict(
+            time=tstep["time"],
+            rotations=[
+                r for r in tstep["rotations"] if r[0] in affected[tstep["time"]]
+            ],
+        )
+        for tstep in rotation_model.get_rotation_series(*sorted(affected))
+    )
+
+    raw = db.engine.raw_connection()
+    try:
+        with raw.cursor() as cursor:
+            cursor.executemany(__delete_interval_sql, deletions)
+        count = copy_rotations(model.id, rotations, connection=raw)
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+    return count
 
-    for tstep in rotations:
-        time = tstep["time"]
-        print(model.name, " - ", time, " Ma")
-        rows = [
-            build_cache_row(model.id, plate_id, time, q)
-            for plate_id, q in tstep["rotations"]
-            if q is not None
-        ]
-        add_to_cache(session, rows)
 
-        # Add derived columns
-        # session.execute(update_derived, model_id=model.id, t_step=time)
-        # progress.advance(task)
+def _reconstruct_time_step(model, t_step, datasets):
+    # Each time step is written in its own transaction and connection
+    with db.engine.begin() as connection:
+        params = dict(model_id=model.id, t_step=t_step)
+        connection.execute(__reconstruct_plates, params)
+        for dataset_id in datasets:
+            connection.execute(
+                __reconstruct_features, dict(params, dataset_id=dataset_id)
+            )
+    return model.name
 
 
-def build_cache_row(model_id, plate_id, t_step, q):
-    # lat, lon, angle = quaternion_to_euler(q)
-    # # Create geometry as WKT
-    # geom = f"SRID=4326;POINT({lon} {lat})"
+def build_reconstruction_caches(model_names=None, time_step=1, jobs=None):
+    """Rotate plate polygons and cached feature datasets to time steps of the
+    rotation cache, for models (by default, all models).
 
-    return dict(
-        model_id=int(model_id),
-        plate_id=int(plate_id),
-        t_step=float(t_step),
-        rotation=[q.w, q.x, q.y, q.z],
+    Geometries are rotated in PostGIS (using `corelle.rotate_geometry`), with
+    time steps written in parallel over several database connections.
+    Only time steps every `time_step` Myr that are in the rotation cache
+    (and the present day) are reconstructed.
+
+    Returns the number of time steps written.
+    """
+    models = conn.execute(_model.select()).fetchall()
+    if model_names is not None:
+        models = [m for m in models if m.name in model_names]
+    q = text("SELECT DISTINCT dataset_id FROM corelle.feature_cache")
+    datasets = [r[0] for r in conn.execute(q)]
+
+    steps = {}
+    for model in models:
+        res = conn.execute(__cached_steps, dict(model_id=model.id))
+        cached = {float(r[0]) for r in res}
+        t_steps = [
+            t for t in _model_time_steps(model, time_step) if t == 0 or t in cached
+        ]
+        steps[model.name] = t_steps
+        # Remove time steps that are no longer reconstructed
+        with db.engine.begin() as connection:
+            connection.execute(
+                __delete_reconstructions, dict(model_id=model.id, t_steps=t_steps)
+            )
+
+    start = time.perf_counter()
+    with Progress() as progress:
+        tasks = {
+            m.name: progress.add_task(m.name, total=len(steps[m.name])) for m in models
+        }
+        # By default, use no more threads than pooled connections
+        jobs = jobs or db.engine.pool.size()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(_reconstruct_time_step, model, t, datasets)
+                for model in models
+                for t in steps[model.name]
+            ]
+            for future in as_completed(futures):
+                progress.update(tasks[future.result()], advance=1)
+
+    # Served reconstructions have changed
+    for model in models:
+        bump_model_version(model.id)
+
+    count = sum(len(v) for v in steps.values())
+    elapsed = time.perf_counter() - start
+    print(
+        f"Reconstructed {len(datasets)} feature datasets and plate polygons "
+        f"at {count} time steps in {elapsed:.1f} s"
     )
+    return count
+
+
+def compress_payload(payload):
+    """Compressed copies of a JSON payload: gzip, and brotli if the `brotli`
+    module is installed"""
+    data = payload.encode("utf-8")
+    res = dict(geojson_gzip=gzip.compress(data, compresslevel=9), geojson_br=None)
+    if brotli is not None:
+        res["geojson_br"] = brotli.compress(data, mode=brotli.MODE_TEXT)
+    return res
+
+
+def _compress_reconstruction(key):
+    with db.engine.begin() as connection:
+        payload = connection.execute(__reconstruction_payload, key).scalar()
+        if payload is not None:
+            values = dict(key, **compress_payload(payload))
+            connection.execute(__store_reconstruction_payload, values)
+    return key["model_id"]
+
+
+def compress_payloads(model_names=None, overwrite=False, jobs=None):
+    """Store compressed copies of cached plate polygons and reconstructions,
+    for models (by default, all models), which the API sends as-is to
+    clients that accept them.
+
+    Only payloads without compressed copies are compressed, unless
+    `overwrite` is set. Returns the number of payloads compressed.
+    """
+    models = conn.execute(_model.select()).fetchall()
+    if model_names is not None:
+        models = [m for m in models if m.name in model_names]
+    params = dict(model_ids=[m.id for m in models], overwrite=overwrite)
+
+    count = 0
+    with db.engine.begin() as connection:
+        for model_id, payload in connection.execute(__uncompressed_plates, params):
+            values = dict(model_id=model_id, **compress_payload(payload))
+            connection.execute(__store_plates_payload, values)
+            count += 1
 
+    keys = [r._asdict() for r in conn.execute(__uncompressed_reconstructions, params)]
+    start = time.perf_counter()
+    with Progress() as progress:
+        task = progress.add_task("Reconstructions", total=len(keys))
+        # zlib compresses outside the GIL, so threads work in parallel
+        jobs = jobs or db.engine.pool.size()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_compress_reconstruction, k) for k in keys]
+            for future in as_completed(futures):
+                future.result()
+                progress.update(task, advance=1)
+    count += len(keys)
 
-def add_to_cache(session, data):
-    if not data:
-        return
-    # Add a rotation to the database cache
-    session.execute(insert(_rotation_cache), data)
-    session.commit()
+    elapsed = time.perf_counter() - start
+    print(f"Compressed {count} payloads in {elapsed:.1f} s")
+    return count
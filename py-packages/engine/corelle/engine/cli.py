@@ -74,6 +74,21 @@ def _import_features(name, file, overwrite=False):
     import_features(name, file, overwrite=False)
 
 
+@cli.command(name="cache-features")
+@option("--dataset", "datasets", multiple=True, help="Only cache these datasets")
+def _cache_features(datasets=None):
+    """
+    Split feature datasets on plate polygons and cache them
+    """
+    from .load_data import cache_features, feature_datasets
+    from .storage import bump_model_version
+
+    for dataset in datasets or feature_datasets():
+        count = cache_features(dataset)
+        echo(f"Cached {count} features for dataset {dataset}")
+    bump_model_version()
+
+
 @cli.command(name="import-starter-data")
 def import_basic():
     """Import basic models and data"""
@@ -83,14 +98,22 @@ def import_basic():
 
 
 @cli.command(name="reset-cache")
-def cache():
+@option("--model", type=str, default=None, help="Only reset rotations for this model")
+def cache(model=None):
     """
-    Compute and cache rotations
+    Make running servers discard their in-memory caches
     """
-    from .rotate import reset_cache
+    from .storage import bump_model_version, model_id
 
-    reset_cache()
-    echo("Cache was reset!")
+    # Servers discard cached models and rotations when a model's version
+    # changes (this also invalidates exported rotation grids)
+    id = None
+    if model is not None:
+        id = model_id(model)
+        if id is None:
+            raise click.ClickException(f"Unknown model {model}")
+    bump_model_version(id)
+    echo("Cache was reset! Running servers will discard their cached rotations")
 
 
 @cli.command(name="rotate")
@@ -126,8 +149,15 @@ def rotate_all(model, time, verbose=False):
     """
     import numpy as N
     from .rotate import get_all_rotations
+    from .model import get_rotation_model
+
+    if verbose:
+        # Print the plate hierarchy as it is traversed
+        rotations = get_all_rotations(model, time, verbose=verbose)
+    else:
+        rotations = get_rotation_model(model).get_all_rotations(time)
 
-    for plate_id, q in get_all_rotations(model, time, verbose=verbose):
+    for plate_id, q in rotations:
         angle = N.degrees(q.angle())
         echo(f"{plate_id}: rotate {angle:.2f}° around {q.vec}")
 
@@ -135,8 +165,27 @@ def rotate_all(model, time, verbose=False):
 @cli.command(name="serve")
 @option("-p", "--port", type=int, default=5000)
 @option("--debug", is_flag=True, default=False)
-def serve(**kwargs):
+@option(
+    "--async",
+    "use_async",
+    is_flag=True,
+    default=False,
+    help="Serve with an ASGI server and async database pool",
+)
+def serve(use_async=False, **kwargs):
     """Run the application server"""
+    if use_async:
+        try:
+            import uvicorn
+            from corelle.server.asgi import app
+        except ImportError as err:
+            raise click.ClickException(
+                f"The async server requires corelle.server[async] ({err})"
+            )
+        log_level = "debug" if kwargs["debug"] else "info"
+        uvicorn.run(app, host="0.0.0.0", port=kwargs["port"], log_level=log_level)
+        return
+
     from corelle.server import app
 
     app.run(host="0.0.0.0", **kwargs)
@@ -149,11 +198,62 @@ def shell():
 
 
 @cli.command(name="cache-rotations")
-def build_cache():
+@option("--model", "models", type=str, multiple=True, help="Only cache these models")
+@option("--time-step", type=int, default=1, help="Time step (Myr)")
+@option("--processes", "-j", type=int, default=None, help="Number of worker processes")
+def build_cache(models=None, time_step=1, processes=None):
     """Cache rotations for all models"""
     from .cache import build_rotation_caches
 
-    build_rotation_caches()
+    build_rotation_caches(
+        model_names=models or None, time_step=time_step, processes=processes
+    )
+
+
+@cli.command(name="cache-reconstructions")
+@option("--model", "models", type=str, multiple=True, help="Only cache these models")
+@option("--time-step", type=int, default=1, help="Time step (Myr)")
+@option("--jobs", "-j", type=int, default=None, help="Number of parallel connections")
+def build_reconstructions(models=None, time_step=1, jobs=None):
+    """Cache plate polygons and features rotated to each cached time step"""
+    from .cache import build_reconstruction_caches
+
+    build_reconstruction_caches(
+        model_names=models or None, time_step=time_step, jobs=jobs
+    )
+
+
+@cli.command(name="compress-payloads")
+@option("--model", "models", type=str, multiple=True, help="Only compress these models")
+@option("--overwrite", is_flag=True, default=False, help="Recompress all payloads")
+@option("--jobs", "-j", type=int, default=None, help="Number of parallel connections")
+def compress(models=None, overwrite=False, jobs=None):
+    """Store compressed copies of cached plate polygons and reconstructions"""
+    from .cache import compress_payloads
+
+    compress_payloads(model_names=models or None, overwrite=overwrite, jobs=jobs)
+
+
+@cli.command(name="export-rotations")
+@option("--model", "models", type=str, multiple=True, help="Only export these models")
+@option("--time-step", type=int, default=1, help="Time step (Myr)")
+@option(
+    "--output",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Output directory (default: $CORELLE_ROTATION_GRID_DIR)",
+)
+def export_rotations(models=None, time_step=1, output=None):
+    """Export rotation grids that servers can memory-map"""
+    from .storage import conn, _model
+    from .grid import export_rotation_grid
+
+    if not models:
+        models = [m.name for m in conn.execute(_model.select())]
+    for model in models:
+        path = None if output is None else Path(output) / model
+        path = export_rotation_grid(model, path=path, time_step=time_step)
+        echo(f"Exported rotations for {model} to {path}")
 
 
 def parent_dir(_start: str, name: str) -> Path:
@@ -1,11 +1,130 @@
+import os
 from os import environ
-from sqlalchemy.exc import ProgrammingError
+from threading import Lock, local
+from time import perf_counter
+from sqlalchemy.exc import ProgrammingError, TimeoutError
 from macrostrat.utils import relative_path
 from macrostrat.database import Database, run_sql
 from pathlib import Path
 
+
+def env_int(key, default=None):
+    """Read an integer setting from the environment"""
+    value = environ.get(key)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def pool_options():
+    """Connection pool settings, configured using environment variables"""
+    return dict(
+        pool_size=env_int("CORELLE_DB_POOL_SIZE", 5),
+        max_overflow=env_int("CORELLE_DB_MAX_OVERFLOW", 10),
+        pool_timeout=env_int("CORELLE_DB_POOL_TIMEOUT", 30),
+        pool_recycle=env_int("CORELLE_DB_POOL_RECYCLE", 1800),
+        pool_pre_ping=True,
+    )
+
+
 conn_string = environ.get("CORELLE_DB", "postgresql:///plate-rotations")
-db = Database(conn_string)
+db = Database(conn_string, **pool_options())
+
+
+class PoolMetrics:
+    """Statistics about connections checked out of the pool"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0
+        self.max_wait = 0
+
+    def record(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def stats(self, pool):
+        with self._lock:
+            mean_wait = self.total_wait / self.checkouts if self.checkouts else None
+            return dict(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                checkouts=self.checkouts,
+                timeouts=self.timeouts,
+                mean_checkout_ms=None if mean_wait is None else mean_wait * 1000,
+                max_checkout_ms=self.max_wait * 1000,
+            )
+
+
+class ScopedConnection:
+    """A database connection for the current thread, drawn from the pool.
+
+    This can be used like a connection. Each thread gets its own connection
+    when it first executes a query, which is held until `close` returns it
+    to the pool (e.g. at the end of a request).
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.metrics = PoolMetrics()
+        self._local = local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or connection.closed:
+            start = perf_counter()
+            try:
+                connection = self.engine.connect()
+            except TimeoutError:
+                self.metrics.record_timeout()
+                raise
+            self.metrics.record(perf_counter() - start)
+            self._local.connection = connection
+        return connection
+
+    def execute(self, *args, **kwargs):
+        return self.connection.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.connection, name)
+
+    def close(self):
+        """Return the current thread's connection to the pool"""
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def reset(self):
+        """Forget all connections without closing them (e.g. after a fork,
+        when they belong to the parent process)"""
+        self._local = local()
+
+    def stats(self):
+        return self.metrics.stats(self.engine.pool)
+
+
+connection = ScopedConnection(db.engine)
+
+
+def _after_fork():
+    # Connections can't be shared with the parent process
+    db.engine.dispose(close=False)
+    connection.reset()
+
+
+os.register_at_fork(after_in_child=_after_fork)
 
 
 def initialize(drop=False):
@@ -0,0 +1,184 @@
+"""
+Precomputed rotation grids stored as binary arrays on disk.
+
+A grid holds a model's rotations for every plate at a series of time steps,
+as a dense (plates × time steps × 4) array of quaternion components with an
+index of plate IDs and time steps. Grids are memory-mapped read-only, so
+server processes share a single copy through the operating system's page
+cache and don't need to compute rotations when they start.
+"""
+from os import environ
+from pathlib import Path
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import numpy as N
+import quaternion as Q
+
+from .model import get_rotation_model, _lookup
+from .storage import model_version
+
+# Directory containing a subdirectory of arrays for each model
+grid_dir = environ.get("CORELLE_ROTATION_GRID_DIR")
+
+_files = ("plate_id", "t_step", "rotations", "active", "series_active")
+
+
+class RotationGrid:
+    """Rotations for all plates of a model at a series of time steps"""
+
+    def __init__(self, path):
+        path = Path(path)
+        arrays = {k: N.load(path / f"{k}.npy", mmap_mode="r") for k in _files}
+        # The indexes are small, so they are read into memory
+        self.plate_id = N.array(arrays["plate_id"])
+        self.t_step = N.array(arrays["t_step"])
+        # (plates, time steps, 4) quaternion components, NaN where undefined
+        self.rotations = arrays["rotations"]
+        # (plates, time steps) mask of plates with a polygon at each step
+        self.active = arrays["active"]
+        # The same mask for rotation series, which treat missing polygon time
+        # limits differently (see `RotationModel.get_rotation_series`)
+        self.series_active = arrays["series_active"]
+        # Version stamp of the model when the grid was exported (None for
+        # grids exported before versions were recorded)
+        version = path / "version.npy"
+        self.version = int(N.load(version)) if version.exists() else None
+
+    def time_index(self, time):
+        """Index of a time step in the grid, or None if it isn't on the grid"""
+        ix = N.searchsorted(self.t_step, float(time))
+        if ix < len(self.t_step) and self.t_step[ix] == float(time):
+            return int(ix)
+        return None
+
+    def get_rotation(self, plate_id, time):
+        """Get a plate's rotation at a grid time step.
+
+        Returns None if the plate or time is not on the grid, or if the
+        rotation is undefined.
+        """
+        t = self.time_index(time)
+        ix, found = _lookup(self.plate_id, N.array([plate_id]))
+        if t is None or not found[0]:
+            return None
+        q = self.rotations[ix[0], t]
+        if N.isnan(q[0]):
+            return None
+        return N.quaternion(*q)
+
+    def rotation_arrays(self, time, active_only=True, series=False):
+        """Rotations for all plates at a grid time step. With `series`, the
+        active plates are those of a rotation series.
+
+        Returns
+        -------
+        tuple of (plate_id, quaternion) arrays, or None if the time is not on
+        the grid.
+        """
+        t = self.time_index(time)
+        if t is None:
+            return None
+        q = N.asarray(self.rotations[:, t])
+        mask = ~N.isnan(q[:, 0])
+        if active_only:
+            mask &= (self.series_active if series else self.active)[:, t]
+        return self.plate_id[mask], Q.as_quat_array(q[mask])
+
+    def get_all_rotations(self, time, active_only=True, series=False):
+        """Yields (plate_id, quaternion) tuples, or nothing if the time is
+        not on the grid"""
+        res = self.rotation_arrays(time, active_only=active_only, series=series)
+        if res is None:
+            return
+        yield from zip(res[0].tolist(), res[1])
+
+
+def compute_rotation_grid(model_name, t_steps, chunk_size=64):
+    """Compute the arrays of a rotation grid for a model"""
+    model = get_rotation_model(model_name)
+    plate_id = N.array(sorted(model.plates), dtype=int)
+    t_step = N.asarray(t_steps, dtype=float)
+
+    rotations = N.full((len(plate_id), len(t_step), 4), N.nan)
+    rotations[plate_id == 0] = [1, 0, 0, 0]
+    for start in range(0, len(t_step), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        ids, total, resolved = model.series_arrays(t_step[chunk])
+        ix, found = _lookup(ids, plate_id)
+        values = Q.as_float_array(total[ix[found]])
+        values[~resolved[ix[found]]] = N.nan
+        rotations[found, chunk] = values
+
+    # Plate polygons' time ranges (NaN limits never compare as true)
+    ix, found = _lookup(plate_id, model.range_plate_id)
+
+    def active_mask(young_lim, old_lim):
+        active = N.zeros((len(plate_id), len(t_step)), dtype=bool)
+        young, old = young_lim[found, None], old_lim[found, None]
+        N.logical_or.at(active, ix[found], (old > t_step) & (young < t_step))
+        return active
+
+    return dict(
+        plate_id=plate_id,
+        t_step=t_step,
+        rotations=rotations,
+        active=active_mask(model.young_lim, model.old_lim),
+        series_active=active_mask(model.series_young_lim, model.series_old_lim),
+        version=N.array(-1 if model.version is None else model.version),
+    )
+
+
+def export_rotation_grid(model_name, t_steps=None, path=None, time_step=1):
+    """Write a model's rotation grid to disk.
+
+    By default, the grid covers the model's age range every `time_step` Myr.
+    The arrays are written to a temporary directory that replaces any
+    existing grid once it is complete, so that running servers never see
+    a partially written grid.
+    """
+    path = Path(path or _grid_path(model_name))
+    if t_steps is None:
+        model = get_rotation_model(model_name)
+        min_age = int(model.min_age or 0)
+        max_age = int(model.max_age or 1000)
+        t_steps = range(min_age, max_age + 1, time_step)
+    arrays = compute_rotation_grid(model_name, t_steps)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(mkdtemp(dir=path.parent, prefix=f".{path.name}-"))
+    for key in (*_files, "version"):
+        N.save(tmp / f"{key}.npy", arrays[key])
+    if path.exists():
+        old = path.with_name(f".{path.name}-old")
+        path.rename(old)
+        tmp.rename(path)
+        rmtree(old)
+    else:
+        tmp.rename(path)
+    return path
+
+
+def _grid_path(model_name):
+    if grid_dir is None:
+        raise ValueError("CORELLE_ROTATION_GRID_DIR is not set")
+    return Path(grid_dir) / model_name
+
+
+_grids = {}
+
+
+def get_rotation_grid(model_name, reload=False):
+    """Get a model's memory-mapped rotation grid, or None if it hasn't been
+    exported or was exported from an older version of the model (i.e. before
+    the model was re-imported)"""
+    if grid_dir is None:
+        return None
+    if reload or model_name not in _grids:
+        path = _grid_path(model_name)
+        grid = RotationGrid(path) if path.exists() else None
+        current = model_version(model_name)
+        if grid is not None and (current is None or grid.version != current.version):
+            grid = None
+        _grids[model_name] = grid
+    return _grids[model_name]
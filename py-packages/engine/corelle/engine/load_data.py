@@ -1,5 +1,4 @@
 from sqlalchemy import func, text
-from sqlalchemy.exc import IntegrityError
 from sqlalchemy.dialects.postgresql import insert
 from time import perf_counter
 from json import dumps
@@ -18,30 +17,27 @@ from geoalchemy2.shape import from_shape
 from shapely.geometry import shape, MultiPolygon
 from macrostrat.database import run_sql
 
-from .database import db
+from .database import db, connection
 from .query import get_sql
-
-__conn = None
+from .storage import bump_model_version
 
 
 def connect():
-    global __conn
-    if __conn is None:
-        __conn = db.engine.connect()
-    return __conn
+    # The current thread's connection from the pool
+    return connection.connection
 
 
 def create_model(name, **kwargs):
     model = db.reflect_table("model", schema="corelle")
     conn = connect()
-    try:
-        conn.execute(
-            insert(model)
-            .values(name=name, **kwargs)
-            .on_conflict_do_update(index_elements=(model.c.id,), set_=kwargs)
-        )
-    except IntegrityError:
-        pass
+    stmt = insert(model).values(name=name, **kwargs)
+    # Only replace the attributes of an existing model that are provided
+    updates = {k: v for k, v in kwargs.items() if v is not None}
+    if updates:
+        stmt = stmt.on_conflict_do_update(index_elements=(model.c.name,), set_=updates)
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=(model.c.name,))
+    conn.execute(stmt)
     return conn.execute(model.select().where(model.c.name == name)).first()[0]
 
 
@@ -49,6 +45,8 @@ __plate = db.reflect_table("plate", schema="corelle")
 __feature = db.reflect_table("feature", schema="corelle")
 __rotation = db.reflect_table("rotation", schema="corelle")
 __plate_polygon = db.reflect_table("plate_polygon", schema="corelle")
+__feature_cache = db.reflect_table("feature_cache", schema="corelle")
+__reconstruction_cache = db.reflect_table("reconstruction_cache", schema="corelle")
 
 
 def pg_geometry(feature):
@@ -94,8 +92,12 @@ def import_plate(model_id, feature, fields=None):
     return plate, plate_polygon
 
 
-def import_plates(model_id, datafile, fields={}):
-    """Import all plates for a model"""
+def import_plates(model_id, datafile, fields={}, overwrite=False):
+    """Import all plates for a model
+
+    With `overwrite`, existing plates are updated and the model's plate
+    polygons are replaced.
+    """
     if fields is None:
         fields = {}
 
@@ -119,13 +121,35 @@ def import_plates(model_id, datafile, fields={}):
 
     # Run database transaction
     conn = connect()
-    conn.execute(insert(__plate).values(plates))
+    if overwrite:
+        # Plates can't be deleted without also deleting their rotations
+        # and cached rotations, so they are updated in place
+        plates = list({p["id"]: p for p in reversed(plates)}.values())
+        stmt = insert(__plate).values(plates)
+        columns = ("parent_id", "name", "cotid", "coid")
+        conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=(__plate.c.id, __plate.c.model_id),
+                set_={c: stmt.excluded[c] for c in columns},
+            )
+        )
+        conn.execute(
+            __plate_polygon.delete().where(__plate_polygon.c.model_id == model_id)
+        )
+    else:
+        conn.execute(insert(__plate).values(plates))
     for poly in plate_polygons:
         conn.execute(insert(__plate_polygon).values(poly))
     conn.commit()
 
     # For faster updates, this materialized view could become an actual table
     run_sql(conn, "REFRESH MATERIALIZED VIEW corelle.plate_polygon_cache")
+    # Compressed copies of the model's plate polygons are out of date
+    conn.execute(
+        text("DELETE FROM corelle.plate_polygon_payload WHERE model_id = :model_id"),
+        dict(model_id=model_id),
+    )
+    conn.commit()
 
 
 def create_feature(dataset, feature):
@@ -162,12 +186,41 @@ def import_features(name, features, overwrite=False):
         + f" in {elapsed:.2f} seconds"
     )
 
-    sql = get_sql("cache-feature-dataset")
-    conn.execute(sql, dict(dataset_id=name))
-    conn.commit()
+    count = cache_features(name)
+    bump_model_version()
 
     elapsed = perf_counter() - step1
-    echo(f"  cached transformed features in {elapsed:.2f} seconds")
+    echo(f"  cached {count} transformed features in {elapsed:.2f} seconds")
+
+
+__cache_features = get_sql("cache-feature-dataset")
+
+
+def cache_features(dataset_id, model_id=None):
+    """Split a feature dataset on the plate polygons of each model (or of
+    one model) and replace its cached features. Callers should bump the
+    version of the affected models afterwards."""
+    conn = connect()
+    stmt = __feature_cache.delete().where(__feature_cache.c.dataset_id == dataset_id)
+    if model_id is not None:
+        stmt = stmt.where(__feature_cache.c.model_id == model_id)
+    conn.execute(stmt)
+    res = conn.execute(__cache_features, dict(dataset_id=dataset_id, model_id=model_id))
+    # Reconstructions of the dataset are out of date
+    stmt = __reconstruction_cache.delete().where(
+        __reconstruction_cache.c.dataset_id == dataset_id
+    )
+    if model_id is not None:
+        stmt = stmt.where(__reconstruction_cache.c.model_id == model_id)
+    conn.execute(stmt)
+    conn.commit()
+    return res.rowcount
+
+
+def feature_datasets():
+    """Names of all imported feature datasets"""
+    q = text("SELECT DISTINCT dataset_id FROM corelle.feature ORDER BY dataset_id")
+    return [r[0] for r in connect().execute(q)]
 
 
 def create_rotation_row(model_id, line):
@@ -208,7 +261,7 @@ def create_rotation_row(model_id, line):
     return rotation, [ref_plate, plate]
 
 
-def import_rotations(model_id, filename):
+def import_rotations(model_id, filename, overwrite=False):
     """
     Import a set of plate rotations defined
     in a GPlates rotation file structure.
@@ -217,6 +270,8 @@ def import_rotations(model_id, filename):
     PaleoPlates data, so it might not work
     well for other `.rot` files in its current
     form.
+
+    With `overwrite`, the model's existing rotations are replaced.
     """
     rotations = []
     plates = []
@@ -230,12 +285,19 @@ def import_rotations(model_id, filename):
 
     conn = connect()
     trans = conn.begin()
+    if overwrite:
+        conn.execute(__rotation.delete().where(__rotation.c.model_id == model_id))
     conn.execute(
         insert(__plate)
         .values(plates)
         .on_conflict_do_nothing(index_elements=(__plate.c.id, __plate.c.model_id))
     )
     conn.execute(insert(__rotation).values(rotations).on_conflict_do_nothing())
+    # Pair consecutive steps for interpolation
+    conn.execute(
+        text("SELECT corelle.update_rotation_intervals(:model_id)"),
+        dict(model_id=model_id),
+    )
     trans.commit()
 
     elapsed = perf_counter() - start
@@ -253,10 +315,76 @@ def import_model(
         print("Model has already been imported.")
         return
 
+    exists = res == 1
     model_id = create_model(name, min_age=min_age, max_age=max_age)
-    import_plates(model_id, plates, fields=load_fields(fields))
-    import_rotations(model_id, rotations)
-    # Right now we don't cache rotations on model import, but we could.
+    if exists:
+        old_rotations = model_rotations(model_id)
+        old_ranges = plate_ranges(name)
+
+    import_plates(model_id, plates, fields=load_fields(fields), overwrite=exists)
+    import_rotations(model_id, rotations, overwrite=exists)
+
+    if exists:
+        # Refresh only the cached rotations affected by the changes
+        refresh_model_cache(name, model_id, old_rotations, old_ranges)
+        # Cached features were split on the replaced plate polygons
+        for dataset_id in feature_datasets():
+            cache_features(dataset_id, model_id=model_id)
+        # Reconstructions must be rebuilt with `corelle cache-reconstructions`
+        conn.execute(
+            __reconstruction_cache.delete().where(
+                __reconstruction_cache.c.model_id == model_id
+            )
+        )
+        conn.commit()
+
+    from .cache import compress_payloads
+
+    compress_payloads([name])
+    # Only mark the model as changed once all derived data has been rebuilt,
+    # so that responses built from stale caches don't get the new version
+    bump_model_version(model_id)
+
+
+def model_rotations(model_id):
+    """Rotation rows for a model"""
+    stmt = __rotation.select().where(__rotation.c.model_id == model_id)
+    return connect().execute(stmt).fetchall()
+
+
+def plate_ranges(model_name):
+    """Time ranges of each plate's polygons"""
+    res = connect().execute(
+        get_sql("plate-polygon-ranges"), dict(model_name=model_name)
+    )
+    ranges = {}
+    for r in res:
+        ranges.setdefault(r.id, []).append((r.young_lim, r.old_lim))
+    return {k: sorted(v, key=str) for k, v in ranges.items()}
+
+
+def refresh_model_cache(model_name, model_id, old_rotations, old_ranges):
+    """Update cached rotations after a model is re-imported"""
+    from .cache import changed_intervals, refresh_rotation_cache
+    from .rotate import reset_cache
+
+    start = perf_counter()
+    intervals = changed_intervals(old_rotations, model_rotations(model_id))
+
+    # Plates with changed polygons may be active at different times, so
+    # they are refreshed over the whole model
+    new_ranges = plate_ranges(model_name)
+    for plate_id in old_ranges.keys() | new_ranges.keys():
+        if old_ranges.get(plate_id) != new_ranges.get(plate_id):
+            intervals[plate_id] = [(float("-inf"), float("inf"))]
+
+    reset_cache(model_name)
+    count = refresh_rotation_cache(model_name, intervals)
+    elapsed = perf_counter() - start
+    print(
+        f"Refreshed {count} cached rotations for {len(intervals)} plates "
+        f"in {elapsed:.2f} seconds"
+    )
 
 
 def load_fields(fn):
@@ -0,0 +1,138 @@
+"""
+A bounded, thread-safe least-recently-used cache for computed rotations.
+"""
+import sys
+from collections import OrderedDict, defaultdict
+from threading import RLock
+
+from .database import env_int
+
+_missing = object()
+
+
+def entry_size(key, value):
+    """Approximate memory footprint of a cache entry, in bytes"""
+    key_size = sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key)
+    return key_size + sys.getsizeof(value)
+
+
+class LRUCache:
+    """Least-recently-used cache bounded by number of entries and/or bytes.
+
+    Keys are tuples whose first element is a model name, which allows all
+    entries for a model to be invalidated at once.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._models = defaultdict(set)
+        self._lock = RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def get(self, key, default=None):
+        """Get a value and mark it as recently used.
+
+        Returns `default` on a cache miss (cached values may be None).
+        """
+        with self._lock:
+            value = self._data.get(key, _missing)
+            if value is _missing:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            size = entry_size(key, value)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._models[key[0]].add(key)
+            self.bytes += size
+            while self._over_capacity():
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+        return value
+
+    def _over_capacity(self):
+        if len(self._data) <= 1:
+            return False
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.bytes > self.max_bytes
+
+    def _remove(self, key):
+        del self._data[key]
+        self.bytes -= self._sizes.pop(key)
+        keys = self._models[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._models[key[0]]
+
+    def invalidate(self, model_name=None):
+        """Remove cached entries for a model, or for all models"""
+        with self._lock:
+            if model_name is None:
+                count = len(self._data)
+                self._data.clear()
+                self._sizes.clear()
+                self._models.clear()
+                self.bytes = 0
+                return count
+            keys = list(self._models.get(model_name, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def resize(self, max_entries=None, max_bytes=None):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            while self._over_capacity():
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def stats(self):
+        """Cache statistics, suitable for exposing at runtime"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                entries=len(self._data),
+                bytes=self.bytes,
+                max_entries=self.max_entries,
+                max_bytes=self.max_bytes,
+                models=sorted(self._models.keys()),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=self.hits / lookups if lookups else None,
+            )
+
+
+def rotation_cache_from_environment():
+    """Create a rotation cache sized using environment variables.
+
+    `CORELLE_ROTATION_CACHE_ENTRIES` (default 50000) and
+    `CORELLE_ROTATION_CACHE_BYTES` (default unbounded) set the limits.
+    """
+    return LRUCache(
+        max_entries=env_int("CORELLE_ROTATION_CACHE_ENTRIES", 50000),
+        max_bytes=env_int("CORELLE_ROTATION_CACHE_BYTES"),
+    )
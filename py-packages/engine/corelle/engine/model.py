@@ -0,0 +1,468 @@
+"""
+An in-memory rotation engine. A model's rotation table is loaded from the
+database once and held in NumPy arrays, so that rotations can be resolved
+without further round trips to the database.
+"""
+import numpy as N
+import quaternion as Q
+
+from .query import get_sql
+from .rotate import RotationError
+from .storage import conn, _model
+
+__model_rotations = get_sql("rotations-for-model")
+__plate_ranges = get_sql("plate-polygon-ranges")
+__model_plates = get_sql("plates-for-model")
+
+identity = N.quaternion(1, 0, 0, 0)
+
+
+def _euler_to_quaternions(rotations):
+    """Convert an (n, 3) array of [lon, lat, angle] Euler poles to quaternions"""
+    lon, lat, angle = N.radians(N.asarray(rotations, dtype=float).reshape(-1, 3)).T
+    scalar = N.sin(angle / 2)
+    arr = N.column_stack(
+        [
+            N.cos(angle / 2),
+            N.cos(lat) * N.cos(lon) * scalar,
+            N.cos(lat) * N.sin(lon) * scalar,
+            N.sin(lat) * scalar,
+        ]
+    )
+    return Q.as_quat_array(arr)
+
+
+def _lookup(sorted_ids, values):
+    """Find the positions of values in a sorted array of IDs.
+
+    Returns the positions and a mask of which values were found.
+    """
+    ix = N.searchsorted(sorted_ids, values)
+    ix[ix == len(sorted_ids)] = 0
+    found = N.zeros(len(ix), dtype=bool)
+    if len(sorted_ids) > 0:
+        found = sorted_ids[ix] == values
+    return ix, found
+
+
+def _expand(start, stop):
+    """Expand ranges [start, stop) into (range index, value) arrays"""
+    count = N.maximum(stop - start, 0)
+    src = N.repeat(N.arange(len(start)), count)
+    offset = N.arange(count.sum()) - N.repeat(N.cumsum(count) - count, count)
+    return src, start[src] + offset
+
+
+def _compose(q_rel, parent, has_parent, resolved):
+    """Compose relative rotations down the plate tree, level by level.
+
+    Each rotation's total is its parent's total rotation composed with its
+    relative rotation. `resolved` marks rotations relative to the root
+    (the spin axis). Rotations without a path to the root (e.g. loops in
+    the hierarchy or missing reference plates) are left unresolved.
+    """
+    total = q_rel.copy()
+    resolved = resolved.copy()
+    while True:
+        ready = ~resolved & has_parent
+        ready[ready] = resolved[parent[ready]]
+        if not ready.any():
+            break
+        total[ready] = total[parent[ready]] * q_rel[ready]
+        resolved |= ready
+    return total, resolved
+
+
+class RotationModel:
+    """A plate-rotation model held entirely in memory.
+
+    Rotation steps are stored sorted by plate, reference plate and time,
+    so consecutive steps for the same plate and reference plate form the
+    pairs that are interpolated between (as in the `rotation-pairs` queries).
+    """
+
+    def __init__(
+        self,
+        name,
+        rotations,
+        plate_ranges,
+        plates=None,
+        min_age=None,
+        max_age=None,
+        version=None,
+    ):
+        self.name = name
+        self.min_age = min_age
+        self.max_age = max_age
+        # Version stamp of the model's data when it was loaded
+        self.version = version
+
+        rows = sorted(
+            (int(r.plate_id), int(r.ref_plate_id), float(r.t_step), r.rotation)
+            for r in rotations
+        )
+        self.plate_id = N.array([r[0] for r in rows], dtype=int)
+        self.ref_plate_id = N.array([r[1] for r in rows], dtype=int)
+        self.t_step = N.array([r[2] for r in rows], dtype=float)
+        self.quaternion = _euler_to_quaternions([r[3] for r in rows])
+
+        # Time of the next step in the same plate/reference-plate sequence
+        # (NaN for the last step of each sequence)
+        self.next_step = N.full(len(rows), N.nan)
+        if len(rows) > 1:
+            same = (self.plate_id[1:] == self.plate_id[:-1]) & (
+                self.ref_plate_id[1:] == self.ref_plate_id[:-1]
+            )
+            self.next_step[:-1][same] = self.t_step[1:][same]
+
+        ids, start, count = N.unique(
+            self.plate_id, return_index=True, return_counts=True
+        )
+        self._rows = {int(i): N.arange(s, s + c) for i, s, c in zip(ids, start, count)}
+        # Plates that rotate relative to a reference plate
+        self.rotating_plates = ids[ids != 0]
+
+        # Plate polygons' time ranges, used to find the active plates at a time
+        ranges = list(plate_ranges)
+        self.range_plate_id = N.array([int(r.id) for r in ranges], dtype=int)
+        self.young_lim = N.array(
+            [N.nan if r.young_lim is None else float(r.young_lim) for r in ranges]
+        )
+        self.old_lim = N.array(
+            [N.nan if r.old_lim is None else float(r.old_lim) for r in ranges]
+        )
+        # Rotation series treat missing limits as the present day and 4500 Ma
+        # (as in the `plate-time-ranges` query)
+        self.series_young_lim = N.nan_to_num(self.young_lim, nan=0)
+        self.series_old_lim = N.nan_to_num(self.old_lim, nan=4500)
+
+        if plates is None:
+            plates = N.union1d(ids, self.range_plate_id)
+        self.plates = [int(p) for p in plates]
+
+    def _active_plate_ids(self, time, series=False):
+        # NULL limits are stored as NaN, which never compare as true
+        # (as in the `active-plates-at-time` query)
+        young, old = self.young_lim, self.old_lim
+        if series:
+            young, old = self.series_young_lim, self.series_old_lim
+        mask = (old > time) & (young < time)
+        return self.range_plate_id[mask]
+
+    def active_plates(self, time):
+        """Plates with a polygon that exists at a given time"""
+        return self._active_plate_ids(time).tolist()
+
+    def relative_rotation(self, plate_id, time):
+        """Get the rotation of a plate relative to its reference plate.
+
+        Returns a tuple of the reference plate ID and the quaternion, or
+        None if no rotation is defined for the plate at this time.
+        """
+        ix = self._rows.get(plate_id)
+        if ix is None:
+            return None
+        t_step = self.t_step[ix]
+
+        # Rotations that are exactly at `time`
+        exact = ix[t_step == time]
+        if len(exact) > 0:
+            i = exact[0]
+            return int(self.ref_plate_id[i]), self.quaternion[i]
+
+        # Pairs of steps that bracket `time`
+        span = ix[(t_step < time) & (self.next_step[ix] > time)]
+        if len(span) == 0:
+            return None
+        i = span[0]
+        q = Q.slerp(
+            self.quaternion[i],
+            self.quaternion[i + 1],
+            self.t_step[i],
+            self.t_step[i + 1],
+            time,
+        )
+        return int(self.ref_plate_id[i]), q
+
+    def get_rotation(self, plate_id, time):
+        """Rotate a plate to a time by accumulating quaternions"""
+        return self._resolve(plate_id, float(time), {}, ())
+
+    def _resolve(self, plate_id, time, memo, path):
+        if plate_id is None or plate_id == 0:
+            return identity
+        if plate_id in memo:
+            return memo[plate_id]
+        if plate_id in path:
+            # A loop in the plate hierarchy has no defined rotation
+            return None
+
+        q = None
+        rel = self.relative_rotation(plate_id, time)
+        if rel is not None:
+            ref_plate_id, q_rel = rel
+            base = self._resolve(ref_plate_id, time, memo, path + (plate_id,))
+            if base is not None:
+                q = base * q_rel
+        memo[plate_id] = q
+        return q
+
+    def relative_rotations(self, time):
+        """Get the rotations of all plates relative to their reference plates.
+
+        Returns
+        -------
+        tuple of (plate_id, ref_plate_id, quaternion) arrays
+        """
+        exact = self.t_step == time
+        span = (self.t_step < time) & (self.next_step > time)
+        # The spin axis is fixed, whatever rotations are defined for it
+        ix = N.nonzero((exact | span) & (self.plate_id != 0))[0]
+
+        # Keep one row per plate, preferring exact matches over interpolated
+        # pairs (as in `relative_rotation`)
+        ix = ix[N.lexsort((ix, ~exact[ix], self.plate_id[ix]))]
+        _, first = N.unique(self.plate_id[ix], return_index=True)
+        ix = ix[first]
+
+        q = self.quaternion[ix]
+        interp = ~exact[ix]
+        i = ix[interp]
+        q[interp] = Q.slerp(
+            self.quaternion[i],
+            self.quaternion[i + 1],
+            self.t_step[i],
+            self.t_step[i + 1],
+            time,
+        )
+        return self.plate_id[ix], self.ref_plate_id[ix], q
+
+    def rotation_arrays(self, time, active_only=True, plates=None):
+        """Compute rotations for many plates at a time step in a single pass.
+
+        Plates are resolved level by level from the root of the plate tree,
+        composing each plate's relative rotation with its parent's (already
+        computed) total rotation in one vectorized operation per level.
+
+        Returns
+        -------
+        tuple of (plate_id, quaternion) arrays, omitting plates without
+        a defined rotation.
+        """
+        time = float(time)
+        if plates is None:
+            plates = self.active_plates(time) if active_only else self.plates
+
+        plate_id, ref_plate_id, q_rel = self.relative_rotations(time)
+        parent, has_parent = _lookup(plate_id, ref_plate_id)
+        total, resolved = _compose(q_rel, parent, has_parent, ref_plate_id == 0)
+
+        plates = N.asarray(plates, dtype=int)
+        ix, found = _lookup(plate_id, plates)
+        found[found] = resolved[ix[found]]
+
+        res = N.full(len(plates), N.nan, dtype=N.quaternion)
+        res[found] = total[ix[found]]
+        res[plates == 0] = identity
+        valid = ~N.isnan(Q.as_float_array(res)[:, 0])
+        return plates[valid], res[valid]
+
+    def get_all_rotations(self, time, active_only=True, plates=None):
+        """Get rotations for all plates at a time step
+
+        Yields
+        ------
+        tuple of (plate_id, quaternion)
+        """
+        ids, rotations = self.rotation_arrays(
+            time, active_only=active_only, plates=plates
+        )
+        yield from zip(ids.tolist(), rotations)
+
+    def relative_series(self, times, plates=None):
+        """Get the rotations of plates relative to their reference plates
+        at an array of times.
+
+        Rather than searching the rotation table once per time, each
+        rotation step and each interval between consecutive steps is
+        located among the (sorted) times, so the whole series is indexed
+        at once and interpolated in a single vectorized call.
+
+        Returns
+        -------
+        tuple of (ref_plate_id, quaternion, defined) arrays with shape
+        (plates, times), for a sorted array of plate IDs (by default,
+        those in `rotating_plates`).
+        """
+        times = N.asarray(times, dtype=float)
+        order = N.argsort(times, kind="stable")
+        sorted_times = times[order]
+        if plates is None:
+            plates = self.rotating_plates
+        n, m = len(plates), len(times)
+
+        # Times that fall exactly on each step, and strictly inside the
+        # interval between each step and the next step in its sequence
+        start = N.searchsorted(sorted_times, self.t_step, "left")
+        stop = N.searchsorted(sorted_times, self.t_step, "right")
+        has_next = ~N.isnan(self.next_step)
+        span_stop = stop.copy()
+        span_stop[has_next] = N.searchsorted(
+            sorted_times, self.next_step[has_next], "left"
+        )
+        rotating = self.plate_id != 0
+        if plates is not self.rotating_plates:
+            rotating &= N.isin(self.plate_id, plates)
+        start[~rotating] = stop[~rotating]
+        span_stop[~rotating] = stop[~rotating]
+
+        exact_row, exact_ix = _expand(start, stop)
+        span_row, span_ix = _expand(stop, span_stop)
+        row = N.concatenate([exact_row, span_row])
+        ix = N.concatenate([exact_ix, span_ix])
+        interp = N.r_[N.zeros(len(exact_row), bool), N.ones(len(span_row), bool)]
+
+        # Where several steps match a plate at a time, exact matches take
+        # priority over interpolated pairs, then the first row in order
+        k = N.searchsorted(plates, self.plate_id[row])
+        flat = k * m + order[ix]
+        sort = N.lexsort((row, interp, flat))
+        first = N.ones(len(sort), dtype=bool)
+        first[1:] = flat[sort][1:] != flat[sort][:-1]
+        sort = sort[first]
+        flat, row, interp = flat[sort], row[sort], interp[sort]
+
+        ref = N.zeros(n * m, dtype=int)
+        ref[flat] = self.ref_plate_id[row]
+        defined = N.zeros(n * m, dtype=bool)
+        defined[flat] = True
+        q = N.full(n * m, identity)
+        q[flat] = self.quaternion[row]
+        i = row[interp]
+        q[flat[interp]] = Q.slerp(
+            self.quaternion[i],
+            self.quaternion[i + 1],
+            self.t_step[i],
+            self.t_step[i + 1],
+            times[order[ix[sort][interp]]],
+        )
+        return ref.reshape(n, m), q.reshape(n, m), defined.reshape(n, m)
+
+    def series_arrays(self, times):
+        """Compute rotations for all plates at an array of times.
+
+        Returns
+        -------
+        tuple of (plate_id, quaternion, resolved) arrays. The quaternion
+        and resolved arrays have shape (plates, times).
+        """
+        plates = self.rotating_plates
+        ref, q_rel, defined = self.relative_series(times)
+        n, m = ref.shape
+
+        # Compose over the flattened (plate, time) arrays, with each
+        # rotation's parent at the same time step
+        ref = ref.ravel()
+        defined = defined.ravel()
+        parent, has_parent = _lookup(plates, ref)
+        parent = parent * m + N.tile(N.arange(m), n)
+        total, resolved = _compose(
+            q_rel.ravel(), parent, has_parent & defined, (ref == 0) & defined
+        )
+        return plates, total.reshape(n, m), resolved.reshape(n, m)
+
+    def plate_rotation_series(self, plate_id, times):
+        """Get the rotations of a single plate at an array of times.
+
+        The plate's chain of reference plates is followed upwards for all
+        times at once, so each level of the hierarchy costs one vectorized
+        lookup rather than a recursive resolution per time step.
+
+        Returns
+        -------
+        tuple of (quaternion, resolved) arrays
+        """
+        times = N.asarray(times, dtype=float)
+        total = N.full(len(times), identity)
+        current = N.full(len(times), int(plate_id))
+        failed = N.zeros(len(times), dtype=bool)
+
+        # Plates already visited on each time's chain, to detect loops in
+        # the hierarchy
+        visited = [current.copy()]
+        while True:
+            pending = N.nonzero((current != 0) & ~failed)[0]
+            if len(pending) == 0:
+                break
+            plates = N.unique(current[pending])
+            ref, q_rel, defined = self.relative_series(times[pending], plates)
+            k = N.searchsorted(plates, current[pending])
+            cols = N.arange(len(pending))
+            defined = defined[k, cols]
+            failed[pending[~defined]] = True
+            pending, k, cols = pending[defined], k[defined], cols[defined]
+            total[pending] = q_rel[k, cols] * total[pending]
+            current[pending] = ref[k, cols]
+            for v in visited:
+                failed[pending] |= v[pending] == current[pending]
+            visited.append(current.copy())
+
+        resolved = (current == 0) & ~failed
+        total[~resolved] = N.quaternion(N.nan, N.nan, N.nan, N.nan)
+        return total, resolved
+
+    def get_rotation_series(self, *times, active_only=True, plates=None, chunk_size=64):
+        """Get rotations for all plates at a series of times.
+
+        Times are computed in chunks of `chunk_size`, so that results can
+        be yielded before the whole series is complete.
+
+        Yields
+        ------
+        dict of `time` and `rotations`, a list of (plate_id, quaternion) tuples
+        """
+        times = [float(t) for t in times]
+        all_plates = N.asarray(self.plates if plates is None else plates, dtype=int)
+        for start in range(0, len(times), chunk_size):
+            chunk = times[start : start + chunk_size]
+            plate_id, total, resolved = self.series_arrays(chunk)
+            for k, t in enumerate(chunk):
+                _plates = all_plates
+                if plates is None and active_only:
+                    _plates = self._active_plate_ids(t, series=True)
+                ix, found = _lookup(plate_id, _plates)
+                found[found] = resolved[ix[found], k]
+
+                res = N.full(len(_plates), N.nan, dtype=N.quaternion)
+                res[found] = total[ix[found], k]
+                res[_plates == 0] = identity
+                valid = ~N.isnan(Q.as_float_array(res)[:, 0])
+                rotations = list(zip(_plates[valid].tolist(), res[valid]))
+                yield dict(rotations=rotations, time=t)
+
+
+def load_rotation_model(model_name):
+    """Load a model's rotations from the database"""
+    model = conn.execute(_model.select().where(_model.c.name == model_name)).first()
+    if model is None:
+        raise RotationError("Unknown model id")
+    params = dict(model_name=model_name)
+    return RotationModel(
+        model_name,
+        conn.execute(__model_rotations, params).fetchall(),
+        conn.execute(__plate_ranges, params).fetchall(),
+        plates=[r[0] for r in conn.execute(__model_plates, params)],
+        min_age=None if model.min_age is None else float(model.min_age),
+        max_age=None if model.max_age is None else float(model.max_age),
+        version=model.version,
+    )
+
+
+_models = {}
+
+
+def get_rotation_model(model_name, reload=False):
+    """Get an in-memory rotation model, loading it on first use"""
+    if reload or model_name not in _models:
+        _models[model_name] = load_rotation_model(model_name)
+    return _models[model_name]
@@ -1,7 +1,101 @@
-from macrostrat.utils import relative_path
+"""
+SQL queries, read once from the `.sql` files in this directory.
+
+Frequently-run queries are also executed as server-side prepared
+statements (see `execute`), so that Postgres doesn't re-parse and
+re-plan them on every request.
+"""
+import re
+from os import environ
+from pathlib import Path
+
 from sqlalchemy import text
 
+__dir = Path(__file__).parent
+_sources = {f.stem: f.read_text() for f in sorted(__dir.glob("*.sql"))}
+_queries = {k: text(v) for k, v in _sources.items()}
+
 
 def get_sql(key):
-    fn = relative_path(__file__, key + ".sql")
-    return text(open(fn).read())
+    """Get a query by name"""
+    return _queries[key]
+
+
+# Parameter types of queries that are run as prepared statements
+prepared_queries = {
+    "plate-for-point": dict(
+        model_name="text",
+        lon="double precision",
+        lat="double precision",
+        time="numeric",
+    ),
+    "plates-for-points": dict(
+        lons="double precision[]",
+        lats="double precision[]",
+        times="double precision[]",
+        model_name="text",
+    ),
+    "rotation-pairs-for-time": dict(model_name="text", time="numeric"),
+    "active-plates-at-time": dict(model_name="text", time="numeric"),
+}
+
+# Prepared statements can be disabled, e.g. behind a transaction-pooling
+# proxy that doesn't keep sessions on a single server connection
+use_prepared_statements = environ.get(
+    "CORELLE_PREPARED_STATEMENTS", "true"
+).lower() in ("1", "true", "yes")
+
+_comments = re.compile(r"/\*.*?\*/|--[^\n]*", re.DOTALL)
+_bind_params = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def statement_name(key):
+    return "corelle_" + key.replace("-", "_")
+
+
+def positional_sql(key, names=None):
+    """A query with its named parameters replaced by positional ones
+    (`$1`, `$2`, ...), for drivers that don't support named parameters.
+
+    Returns the SQL and the parameter names in order. By default, parameters
+    are numbered in the order that they first appear.
+    """
+    sql = _comments.sub("", _sources[key])
+    if names is None:
+        names = list(dict.fromkeys(_bind_params.findall(sql)))
+    positions = {k: f"${i+1}" for i, k in enumerate(names)}
+
+    def replace(match):
+        return positions[match.group(1)]
+
+    return _bind_params.sub(replace, sql), list(names)
+
+
+def prepare_sql(key):
+    """A `PREPARE` statement for a query, with its named parameters
+    replaced by positional ones"""
+    types = prepared_queries[key]
+    body, _ = positional_sql(key, names=types)
+    return f"PREPARE {statement_name(key)} ({', '.join(types.values())}) AS {body}"
+
+
+_prepare = {k: text(prepare_sql(k)) for k in prepared_queries}
+_execute = {
+    k: text(f"EXECUTE {statement_name(k)} ({', '.join(':' + p for p in v)})")
+    for k, v in prepared_queries.items()
+}
+
+
+def execute(conn, key, params):
+    """Run a query, as a prepared statement if it is one of `prepared_queries`.
+
+    Statements are prepared the first time they are used on each pooled
+    connection, and last for the life of that connection.
+    """
+    if not use_prepared_statements or key not in prepared_queries:
+        return conn.execute(_queries[key], params)
+    prepared = conn.info.setdefault("prepared_statements", set())
+    if key not in prepared:
+        conn.execute(_prepare[key])
+        prepared.add(key)
+    return conn.execute(_execute[key], params)
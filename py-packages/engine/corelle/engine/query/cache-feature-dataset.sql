@@ -1,37 +1,54 @@
-WITH a AS (
+/*
+Split a feature dataset on the plate polygons of each model (or of a
+single model, if `model_id` is provided) and cache the pieces as
+GeoJSON features.
+*/
+INSERT INTO corelle.feature_cache (
+  model_id,
+  dataset_id,
+  feature_id,
+  plate_polygon_id,
+  plate_id,
+  geometry,
+  geojson
+)
 SELECT
   model_id,
-  json_agg(json_build_object(
-  'id', f.id,
-  'properties', properties || jsonb_build_object(
-		'plate_id', plate_id,
-		'young_lim', coalesce(young_lim, m.min_age),
-		'old_lim', coalesce(old_lim, m.max_age)
-  ),
-  'geometry', ST_AsGeoJSON(
+  dataset_id,
+  feature_id,
+  plate_polygon_id,
+  plate_id,
+  geometry,
+  json_build_object(
+    'id', feature_id,
+    'properties', properties || jsonb_build_object(
+      'plate_id', plate_id,
+      'young_lim', young_lim,
+      'old_lim', old_lim
+    ),
+    'geometry', ST_AsGeoJSON(geometry)::jsonb,
+    'type', 'Feature'
+  )
+FROM (
+  SELECT
+    p.model_id,
+    f.dataset_id,
+    f.id feature_id,
+    p.id plate_polygon_id,
+    p.plate_id,
+    f.properties,
+    coalesce(p.young_lim, m.min_age) young_lim,
+    coalesce(p.old_lim, m.max_age) old_lim,
     ST_Intersection(
-      ST_Buffer(p.geometry,0),
+      ST_Buffer(p.geometry, 0),
       ST_Buffer(f.geometry, 0)
-    )
-  )::jsonb,
-  'type', 'Feature'
-  )) geojson
-FROM corelle.feature f
-JOIN corelle.plate_polygon p
-  ON p.geometry && f.geometry
- AND ST_Intersects(p.geometry, f.geometry)
-JOIN corelle.model m
-  ON m.id = p.model_id
-WHERE dataset_id = :dataset_id
-GROUP BY model_id
-)
-INSERT INTO corelle.feature_cache (model_id, model_name, geojson, dataset_id)
-SELECT
-	model_id,
-	(SELECT name FROM corelle.model WHERE id = model_id) AS model_name,
-	geojson,
-	:dataset_id dataset_id
-FROM a
-ON CONFLICT (model_id, dataset_id)
-DO UPDATE SET
-  geojson = EXCLUDED.geojson;
+    ) geometry
+  FROM corelle.feature f
+  JOIN corelle.plate_polygon p
+    ON p.geometry && f.geometry
+   AND ST_Intersects(p.geometry, f.geometry)
+  JOIN corelle.model m
+    ON m.id = p.model_id
+  WHERE f.dataset_id = :dataset_id
+    AND (CAST(:model_id AS integer) IS NULL OR p.model_id = :model_id)
+) a
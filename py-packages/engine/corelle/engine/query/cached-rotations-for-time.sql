@@ -0,0 +1,33 @@
+/*
+Cached rotations at the grid steps on either side of a time (or at the
+time itself, if it is on the grid). Nothing is returned if the steps are
+further apart than :tolerance.
+*/
+WITH m AS (
+  SELECT id FROM corelle.model WHERE name = :model_name
+),
+bounds AS (
+  SELECT
+    (SELECT max(t_step)
+       FROM corelle.rotation_cache rc
+      WHERE rc.model_id = m.id
+        AND rc.t_step <= CAST(:time AS numeric)
+    ) young_step,
+    (SELECT min(t_step)
+       FROM corelle.rotation_cache rc
+      WHERE rc.model_id = m.id
+        AND rc.t_step >= CAST(:time AS numeric)
+    ) old_step
+  FROM m
+)
+SELECT
+  rc.plate_id,
+  rc.t_step,
+  rc.rotation
+FROM corelle.rotation_cache rc
+JOIN m
+  ON rc.model_id = m.id
+JOIN bounds b
+  ON rc.t_step IN (b.young_step, b.old_step)
+WHERE b.old_step - b.young_step <= CAST(:tolerance AS numeric)
+ORDER BY rc.plate_id, rc.t_step
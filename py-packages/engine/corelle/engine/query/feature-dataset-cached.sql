@@ -1,4 +1,28 @@
-SELECT geojson
-FROM corelle.feature_cache
-WHERE model_name = :model_name
-  AND dataset_id = :dataset
+/*
+Cached features of a dataset for a model, optionally filtered to
+a bounding box and a set of plate IDs, one page at a time.
+*/
+SELECT
+  c.geojson::text
+FROM corelle.feature_cache c
+JOIN corelle.model m
+  ON m.id = c.model_id
+WHERE m.name = :model_name
+  AND c.dataset_id = :dataset
+  AND (
+    CAST(:plate_id AS integer[]) IS NULL
+    OR c.plate_id = ANY(CAST(:plate_id AS integer[]))
+  )
+  AND (
+    CAST(:bbox AS double precision[]) IS NULL
+    OR c.geometry && ST_MakeEnvelope(
+      (CAST(:bbox AS double precision[]))[1],
+      (CAST(:bbox AS double precision[]))[2],
+      (CAST(:bbox AS double precision[]))[3],
+      (CAST(:bbox AS double precision[]))[4],
+      4326
+    )
+  )
+ORDER BY c.feature_id, c.plate_polygon_id
+LIMIT :limit
+OFFSET :offset
@@ -1,3 +1,3 @@
-SELECT geojson
+SELECT geojson::text
 FROM corelle.plate_polygon_cache
 WHERE model_name = :model_name
@@ -0,0 +1,16 @@
+/*
+A precompressed copy of a model's cached plate polygons, in the first of
+the requested encodings that is available.
+*/
+SELECT v.encoding, v.data
+FROM corelle.plate_polygon_payload p
+JOIN corelle.model m
+  ON m.id = p.model_id
+CROSS JOIN LATERAL (
+  VALUES ('br', p.geojson_br), ('gzip', p.geojson_gzip)
+) v(encoding, data)
+WHERE m.name = :model_name
+  AND v.data IS NOT NULL
+  AND v.encoding = ANY(CAST(:encodings AS text[]))
+ORDER BY array_position(CAST(:encodings AS text[]), v.encoding)
+LIMIT 1
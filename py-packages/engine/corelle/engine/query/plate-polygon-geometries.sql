@@ -0,0 +1,11 @@
+/*
+Plate polygons for a model as WKB, for building an in-memory spatial index
+*/
+SELECT
+  pp.plate_id,
+  coalesce(pp.young_lim, 0) young_lim,
+  pp.old_lim,
+  ST_AsBinary(pp.geometry) geometry
+FROM corelle.plate_polygon pp
+WHERE pp.model_id = (SELECT id FROM corelle.model WHERE name = :model_name)
+ORDER BY pp.id
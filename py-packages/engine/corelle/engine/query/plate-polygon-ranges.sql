@@ -0,0 +1,16 @@
+/*
+Time ranges over which each plate polygon is active. These follow the
+same defaults as the `active-plates-at-time` query.
+*/
+SELECT
+  pp.plate_id id,
+  coalesce(pp.young_lim, m.min_age) young_lim,
+  coalesce(pp.old_lim, m.max_age) old_lim
+FROM corelle.plate_polygon pp
+JOIN corelle.plate p
+  ON p.id = pp.plate_id
+ AND p.model_id = pp.model_id
+JOIN corelle.model m
+  ON pp.model_id = m.id
+WHERE m.name = :model_name
+ORDER BY pp.id
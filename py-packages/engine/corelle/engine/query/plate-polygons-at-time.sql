@@ -0,0 +1,68 @@
+/*
+A model's plate polygons rotated to a time, as an array of GeoJSON features
+(with the same properties as `modern-plate-polygons`). Rotations for each
+plate are computed by the rotation engine and passed in as arrays of plate
+IDs and quaternion components; polygons of plates without a rotation are
+omitted. If `time` is null, the modern polygons are returned unrotated.
+Geometries are simplified after rotation if `tolerance` (in degrees) is
+given.
+*/
+WITH rotation AS (
+SELECT
+  plate_id,
+  ARRAY[w, x, y, z] rotation
+FROM unnest(
+  CAST(:plate_id AS integer[]),
+  CAST(:w AS double precision[]),
+  CAST(:x AS double precision[]),
+  CAST(:y AS double precision[]),
+  CAST(:z AS double precision[])
+) AS r(plate_id, w, x, y, z)
+),
+polygons AS (
+SELECT
+  pp.id,
+  pp.plate_id,
+  coalesce(pp.young_lim, 0) young_lim,
+  pp.old_lim,
+  p.name,
+  CASE WHEN r.rotation IS NULL
+    THEN pp.geometry
+    ELSE corelle.rotate_geometry(pp.geometry, r.rotation)
+  END geometry
+FROM corelle.plate_polygon pp
+JOIN corelle.plate p
+  ON pp.plate_id = p.id
+ AND pp.model_id = p.model_id
+JOIN corelle.model m
+  ON m.id = pp.model_id
+LEFT JOIN rotation r
+  ON r.plate_id = pp.plate_id
+WHERE m.name = :model_name
+  AND (
+    CAST(:time AS numeric) IS NULL
+    OR (
+      coalesce(pp.young_lim, m.min_age, 0) <= CAST(:time AS numeric)
+      AND coalesce(pp.old_lim, m.max_age, 4500) > CAST(:time AS numeric)
+      AND r.rotation IS NOT NULL
+    )
+  )
+)
+SELECT coalesce(json_agg(json_build_object(
+  'id', plate_id,
+  'properties', json_build_object(
+    'id', id,
+    'plate_id', plate_id,
+    'young_lim', young_lim,
+    'old_lim', old_lim,
+    'name', name
+  ),
+  'type', 'Feature',
+  'geometry', ST_AsGeoJSON(
+    CASE WHEN CAST(:tolerance AS double precision) > 0
+      THEN ST_SimplifyPreserveTopology(geometry, CAST(:tolerance AS double precision))
+      ELSE geometry
+    END
+  )::json
+) ORDER BY id), '[]')::text
+FROM polygons
@@ -0,0 +1,25 @@
+/*
+Plate IDs for an array of points, each at its own time. Points are
+identified by their (1-based) position in the input arrays.
+*/
+WITH points AS (
+SELECT
+  ix,
+  ST_SetSRID(ST_MakePoint(lon, lat), 4326) geom,
+  time
+FROM unnest(
+  CAST(:lons AS double precision[]),
+  CAST(:lats AS double precision[]),
+  CAST(:times AS double precision[])
+) WITH ORDINALITY AS p(lon, lat, time, ix)
+)
+SELECT DISTINCT ON (ix)
+  ix,
+  pp.plate_id
+FROM points
+JOIN corelle.plate_polygon pp
+  ON ST_Intersects(pp.geometry, points.geom)
+ AND coalesce(pp.young_lim, 0) < points.time
+ AND points.time < pp.old_lim
+WHERE pp.model_id = (SELECT id FROM corelle.model WHERE name = :model_name)
+ORDER BY ix, pp.id
@@ -0,0 +1,42 @@
+/*
+Rotate the cached pieces of a feature dataset to a time step, using
+the rotation cache, and store them as an array of GeoJSON features.
+Features are only included while their plate polygon exists. At the
+present day, features are included without rotation.
+*/
+INSERT INTO corelle.reconstruction_cache (model_id, layer, dataset_id, t_step, geojson)
+SELECT
+  :model_id,
+  'features',
+  :dataset_id,
+  :t_step,
+  coalesce(json_agg(json_build_object(
+    'id', c.feature_id,
+    'properties', c.geojson->'properties',
+    'geometry', ST_AsGeoJSON(
+      CASE WHEN r.rotation IS NULL
+        THEN c.geometry
+        ELSE corelle.rotate_geometry(c.geometry, CAST(r.rotation AS double precision[]))
+      END
+    )::json,
+    'type', 'Feature'
+  ) ORDER BY c.feature_id, c.plate_polygon_id), '[]')
+FROM corelle.feature_cache c
+JOIN corelle.plate_polygon p
+  ON p.id = c.plate_polygon_id
+JOIN corelle.model m
+  ON m.id = c.model_id
+LEFT JOIN corelle.rotation_cache r
+  ON r.model_id = c.model_id
+ AND r.plate_id = c.plate_id
+ AND r.t_step = :t_step
+WHERE c.model_id = :model_id
+  AND c.dataset_id = :dataset_id
+  AND coalesce(p.young_lim, m.min_age, 0) <= :t_step
+  AND coalesce(p.old_lim, m.max_age, 4500) > :t_step
+  AND (r.rotation IS NOT NULL OR :t_step = 0)
+ON CONFLICT (model_id, layer, dataset_id, t_step)
+DO UPDATE SET
+  geojson = EXCLUDED.geojson,
+  geojson_gzip = NULL,
+  geojson_br = NULL
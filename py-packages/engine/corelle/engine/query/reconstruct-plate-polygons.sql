@@ -0,0 +1,47 @@
+/*
+Rotate a model's plate polygons to a time step, using the rotation
+cache, and store them as an array of GeoJSON features (with the same
+properties as `modern-plate-polygons`).
+*/
+INSERT INTO corelle.reconstruction_cache (model_id, layer, dataset_id, t_step, geojson)
+SELECT
+  :model_id,
+  'plates',
+  '',
+  :t_step,
+  coalesce(json_agg(json_build_object(
+    'id', pp.plate_id,
+    'properties', json_build_object(
+      'id', pp.id,
+      'plate_id', pp.plate_id,
+      'young_lim', coalesce(pp.young_lim, 0),
+      'old_lim', pp.old_lim,
+      'name', p.name
+    ),
+    'geometry', ST_AsGeoJSON(
+      CASE WHEN r.rotation IS NULL
+        THEN pp.geometry
+        ELSE corelle.rotate_geometry(pp.geometry, CAST(r.rotation AS double precision[]))
+      END
+    )::json,
+    'type', 'Feature'
+  ) ORDER BY pp.id), '[]')
+FROM corelle.plate_polygon pp
+JOIN corelle.plate p
+  ON pp.plate_id = p.id
+ AND pp.model_id = p.model_id
+JOIN corelle.model m
+  ON m.id = pp.model_id
+LEFT JOIN corelle.rotation_cache r
+  ON r.model_id = pp.model_id
+ AND r.plate_id = pp.plate_id
+ AND r.t_step = :t_step
+WHERE pp.model_id = :model_id
+  AND coalesce(pp.young_lim, m.min_age, 0) <= :t_step
+  AND coalesce(pp.old_lim, m.max_age, 4500) > :t_step
+  AND (r.rotation IS NOT NULL OR :t_step = 0)
+ON CONFLICT (model_id, layer, dataset_id, t_step)
+DO UPDATE SET
+  geojson = EXCLUDED.geojson,
+  geojson_gzip = NULL,
+  geojson_br = NULL
@@ -0,0 +1,8 @@
+SELECT c.geojson::text
+FROM corelle.reconstruction_cache c
+JOIN corelle.model m
+  ON m.id = c.model_id
+WHERE m.name = :model_name
+  AND c.layer = :layer
+  AND c.dataset_id = :dataset_id
+  AND c.t_step = :time
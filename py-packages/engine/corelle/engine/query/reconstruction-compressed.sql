@@ -0,0 +1,19 @@
+/*
+A precompressed copy of a cached reconstruction, in the first of the
+requested encodings that is available.
+*/
+SELECT v.encoding, v.data
+FROM corelle.reconstruction_cache c
+JOIN corelle.model m
+  ON m.id = c.model_id
+CROSS JOIN LATERAL (
+  VALUES ('br', c.geojson_br), ('gzip', c.geojson_gzip)
+) v(encoding, data)
+WHERE m.name = :model_name
+  AND c.layer = :layer
+  AND c.dataset_id = :dataset_id
+  AND c.t_step = :time
+  AND v.data IS NOT NULL
+  AND v.encoding = ANY(CAST(:encodings AS text[]))
+ORDER BY array_position(CAST(:encodings AS text[]), v.encoding)
+LIMIT 1
@@ -0,0 +1,15 @@
+/*
+All rotation steps for a model, in the same order used to pair
+consecutive steps in the `rotation-pairs` queries.
+*/
+SELECT
+  plate_id,
+  ref_plate_id,
+  t_step,
+  ARRAY[longitude, latitude, angle] rotation
+FROM corelle.rotation
+WHERE model_id = (
+    SELECT id
+    FROM corelle.model
+    WHERE name = :model_name)
+ORDER BY plate_id, ref_plate_id, t_step
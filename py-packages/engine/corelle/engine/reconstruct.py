@@ -0,0 +1,161 @@
+"""
+Batch reconstruction of points and plate polygons to past times.
+"""
+from os import environ
+
+import numpy as N
+import quaternion as Q
+
+from corelle.math import cart2sph, sph2cart
+
+from .model import get_rotation_model
+from .query import execute, get_sql
+from .spatial import get_plate_index
+from .storage import conn
+
+__plate_polygons_at_time = get_sql("plate-polygons-at-time")
+
+# Whether to find plates using an in-memory spatial index by default,
+# rather than querying the database
+use_plate_index = environ.get("CORELLE_PLATE_INDEX", "").lower() in ("1", "true", "yes")
+
+
+def get_plate_ids(model_name, lon, lat, time, use_index=None):
+    """Find the plates containing an array of points at their times.
+
+    Returns an integer array of plate IDs and a mask of which points
+    fall within a plate polygon.
+    """
+    if use_index is None:
+        use_index = use_plate_index
+    if use_index:
+        return get_plate_index(model_name).plate_ids(lon, lat, time)
+
+    plate_ids = N.zeros(len(lon), dtype=int)
+    found = N.zeros(len(lon), dtype=bool)
+    if len(lon) == 0:
+        return plate_ids, found
+    res = execute(
+        conn,
+        "plates-for-points",
+        dict(
+            lons=lon.tolist(),
+            lats=lat.tolist(),
+            times=time.tolist(),
+            model_name=model_name,
+        ),
+    )
+    for ix, plate_id in res:
+        plate_ids[ix - 1] = plate_id
+        found[ix - 1] = True
+    return plate_ids, found
+
+
+def rotate_points(model_name, lon, lat, time, plate_ids, found=None):
+    """Rotate points on known plates to their times.
+
+    Points are grouped by time and plate, and each group is rotated in a
+    single vectorized operation. Returns arrays of rotated longitudes and
+    latitudes, which are NaN where no rotation is defined.
+    """
+    if found is None:
+        found = N.ones(len(lon), dtype=bool)
+
+    out_lon = N.full(len(lon), N.nan)
+    out_lat = N.full(len(lon), N.nan)
+
+    # Points at the present day don't need to be rotated
+    present = time == 0
+    out_lon[present] = lon[present]
+    out_lat[present] = lat[present]
+
+    todo = found & ~present
+    if not todo.any():
+        return out_lon, out_lat
+
+    model = get_rotation_model(model_name)
+    vectors = sph2cart(lon[todo], lat[todo]).T
+    ix = N.nonzero(todo)[0]
+    # Sort points so that each (time, plate) group is contiguous
+    order = N.lexsort((plate_ids[ix], time[ix]))
+    ix = ix[order]
+    vectors = vectors[order]
+
+    keys = N.column_stack([time[ix], plate_ids[ix]])
+    _, start = N.unique(keys, axis=0, return_index=True)
+    bounds = list(start) + [len(ix)]
+
+    rotations = {}
+    for t in N.unique(time[ix]):
+        plates = N.unique(plate_ids[ix][time[ix] == t])
+        ids, qs = model.rotation_arrays(t, plates=plates)
+        for plate_id, q in zip(ids, qs):
+            rotations[(t, plate_id)] = q
+
+    for s, e in zip(bounds[:-1], bounds[1:]):
+        q = rotations.get((time[ix[s]], plate_ids[ix[s]]))
+        if q is None:
+            continue
+        v1 = Q.rotate_vectors(q, vectors[s:e])
+        out_lon[ix[s:e]], out_lat[ix[s:e]] = cart2sph(v1.T)
+
+    return out_lon, out_lat
+
+
+def reconstruct_points(model_name, lon, lat, time, use_index=None):
+    """Reconstruct arrays of points to a time, or to per-point ages.
+
+    If `use_index` is set, plates are found using an in-memory spatial index
+    rather than the database (defaults to the `CORELLE_PLATE_INDEX` setting).
+
+    Returns
+    -------
+    dict of `lon`, `lat` and `plate_id` arrays. Rotated coordinates are NaN
+    for points that could not be reconstructed. Plate IDs are -1 where no
+    plate was found (or none was needed, for points at the present day).
+    """
+    lon = N.asarray(lon, dtype=float)
+    lat = N.asarray(lat, dtype=float)
+    time = N.broadcast_to(N.asarray(time, dtype=float), lon.shape).copy()
+
+    # Plates are only needed for points that will be rotated
+    plate_ids = N.full(len(lon), -1)
+    found = N.zeros(len(lon), dtype=bool)
+    past = time != 0
+    _ids, _found = get_plate_ids(
+        model_name, lon[past], lat[past], time[past], use_index=use_index
+    )
+    plate_ids[past] = N.where(_found, _ids, -1)
+    found[past] = _found
+
+    out_lon, out_lat = rotate_points(model_name, lon, lat, time, plate_ids, found)
+    return dict(lon=out_lon, lat=out_lat, plate_id=plate_ids)
+
+
+def reconstruct_plate_polygons(model_name, time=None, tolerance=None):
+    """Rotate a model's plate polygons to a time, with rotations from the
+    in-memory rotation engine and geometries rotated in PostGIS.
+
+    Polygons are simplified (after rotation) to within `tolerance` degrees,
+    if given. With no time, the modern plate polygons are returned.
+
+    Returns
+    -------
+    str, a JSON array of GeoJSON features
+    """
+    plate_id, q = N.zeros(0, dtype=int), N.zeros((0, 4))
+    if time is not None:
+        ids, rotations = get_rotation_model(model_name).rotation_arrays(time)
+        plate_id, q = ids, Q.as_float_array(rotations).reshape(-1, 4)
+    w, x, y, z = q.T.tolist()
+    params = dict(
+        model_name=model_name,
+        time=time,
+        tolerance=tolerance,
+        plate_id=plate_id.tolist(),
+        w=w,
+        x=x,
+        y=y,
+        z=z,
+    )
+    return conn.execute(__plate_polygons_at_time, params).scalar()
@@ -1,13 +1,16 @@
 import numpy as N
 import quaternion as Q
+from bisect import bisect_right
+from collections import defaultdict
+from os import environ
 from click import secho
-from decimal import Decimal
 
 from corelle.math import cart2sph, sph2cart, euler_to_quaternion, quaternion_to_euler
 
-from .query import get_sql
+from .query import get_sql, execute
 from .database import db
 from .storage import conn, model_id
+from .lru import rotation_cache_from_environment
 
 
 class RotationError(Exception):
@@ -21,21 +24,23 @@ class UndefinedRotationError(RotationError):
         self.time = time
 
 
-cache = {}
-cache_list = []
+# In-memory cache of rotations, keyed on (model_name, plate_id, time)
+cache = rotation_cache_from_environment()
+_missing = object()
 
+# Whether to serve rotations from the database rotation cache by default,
+# and the largest gap between cached time steps that can be interpolated
+use_rotation_cache = environ.get("CORELLE_USE_ROTATION_CACHE", "").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+rotation_cache_tolerance = float(environ.get("CORELLE_ROTATION_CACHE_TOLERANCE", 1))
 
-def build_cache(q, cache_args):
-    # Builds an in-memory cache of rotations
-    cache[cache_args] = q
-    cache_list.append(cache_args)
-    if len(cache_list) > 50000:
-        id = cache_list.pop(0)
-        try:
-            del cache[id]
-        except KeyError:
-            pass
-    return q
+
+def reset_cache(model_name=None):
+    """Clear cached rotations for a model, or for all models"""
+    return cache.invalidate(model_name)
 
 
 __sql = get_sql("rotation-pairs")
@@ -48,6 +53,48 @@ def check_model_id(model_name):
         raise RotationError("Unknown model id")
 
 
+class RowsetIndex:
+    """Rotation pairs indexed by plate ID.
+
+    Each plate's pairs are sorted by start time, so the pair for a plate
+    can be found by bisection rather than by scanning the whole rowset.
+    """
+
+    def __init__(self, rowset):
+        rows = defaultdict(list)
+        for ix, row in enumerate(rowset):
+            rows[row.plate_id].append((float(row.r1_step), ix, row))
+
+        self._steps = {}
+        self._first = {}
+        for plate_id, _rows in rows.items():
+            _rows.sort(key=lambda r: r[0])
+            self._steps[plate_id] = [r[0] for r in _rows]
+            # Of the pairs starting at or before each step, the one that
+            # comes first in the rowset (which is the one we use)
+            first = []
+            for r in _rows:
+                if not first or r[1] < first[-1][1]:
+                    first.append(r)
+                else:
+                    first.append(first[-1])
+            self._first[plate_id] = [r[2] for r in first]
+
+    def __len__(self):
+        return sum(len(v) for v in self._steps.values())
+
+    def find(self, plate_id, time):
+        """Get the first pair in the rowset for a plate that starts at or
+        before `time`"""
+        steps = self._steps.get(plate_id)
+        if steps is None:
+            return None
+        ix = bisect_right(steps, time)
+        if ix == 0:
+            return None
+        return self._first[plate_id][ix - 1]
+
+
 # Cache this expensive, recursive function.
 def get_rotation(
     model_name,
@@ -57,17 +104,38 @@ def get_rotation(
     depth=0,
     rowset=None,
     safe=True,
+    path=(),
+    use_cache=None,
 ):
-    """Core function to rotate a plate to a time by accumulating quaternions"""
+    """Core function to rotate a plate to a time by accumulating quaternions
+
+    If provided, `rowset` should contain the rotation pairs for `time`,
+    either as a list of rows or as a `RowsetIndex`. `path` holds the plates
+    already visited while resolving the hierarchy. With `use_cache`, the
+    rotation is taken from the database rotation cache where possible.
+    """
     time = float(time)
-    cache_args = (model_name, plate_id, Decimal(time))
-    if cache_args in cache:
-        return cache[cache_args]
+    cache_args = (model_name, plate_id, time)
+    q = cache.get(cache_args, _missing)
+    if q is not _missing:
+        return q
 
     if safe:
         check_model_id(model_name)
 
-    __cache = lambda q: build_cache(q, cache_args)
+    if depth == 0 and plate_id:
+        q = _rotation_from_grid(model_name, plate_id, time)
+        if q is not None:
+            return q
+
+    if use_cache is None:
+        use_cache = use_rotation_cache
+    if use_cache and depth == 0 and plate_id:
+        q = rotations_from_cache(model_name, time).get(plate_id)
+        if q is not None:
+            return q
+
+    __cache = lambda q: cache.set(cache_args, q)
 
     prefix = " " * depth
     if verbose:
@@ -78,15 +146,20 @@ def get_rotation(
 
     params = dict(plate_id=plate_id, model_name=model_name, time=time)
 
+    if plate_id in path:
+        # Loops in the plate hierarchy have no defined rotation
+        # (this prevents infinite recursion)
+        return __cache(None)
+    path = path + (plate_id,)
+
     row = None
     pairs = []
-    if rowset:
-        for ix, p in enumerate(rowset):
-            if p.plate_id == plate_id and p.r1_step <= time:
-                pairs = [p]
-                # Remove this row from the rowset (prevents weird recursion errors)
-                rowset = rowset[:ix] + rowset[ix + 1 :]
-                break
+    if rowset is not None:
+        if not isinstance(rowset, RowsetIndex):
+            rowset = RowsetIndex(rowset)
+        pair = rowset.find(plate_id, time)
+        if pair is not None:
+            pairs = [pair]
     else:
         # Fall back to fetching the data ourselves
         pairs = conn.execute(__sql, params).fetchall()
@@ -110,6 +183,7 @@ def get_rotation(
             depth=depth + 1,
             rowset=rowset,
             safe=False,
+            path=path,
         )
         if base is None:
             return __cache(None)
@@ -126,6 +200,7 @@ def get_rotation(
         depth=depth + 1,
         rowset=rowset,
         safe=False,
+        path=path,
     )
     if base is None:
         return __cache(None)
@@ -136,16 +211,34 @@ def get_rotation(
     return __cache(base * res)
 
 
-def plates_for_model(model):
-    sql = get_sql("plates-for-model")
-    for row in conn.execute(sql, dict(model_name=model)):
-        yield row[0]
+def _rotation_from_grid(model_name, plate_id, time):
+    # Memory-mapped rotation grids (see `corelle.engine.grid`)
+    from .grid import get_rotation_grid
+
+    grid = get_rotation_grid(model_name)
+    if grid is None:
+        return None
+    return grid.get_rotation(plate_id, time)
+
+
+def rotations_from_cache(model_name, time):
+    """Get rotations for all plates at a time from the database rotation
+    cache (see `corelle.engine.cache.cached_rotations`). These are also
+    added to the in-memory cache.
+    """
+    from .cache import cached_rotations
+
+    rotations = cached_rotations(model_name, time, tolerance=rotation_cache_tolerance)
+    for plate_id, q in rotations.items():
+        cache.set((model_name, plate_id, float(time)), q)
+    return rotations
 
 
 def get_plate_id(point, model, time):
-    sql = get_sql("plate-for-point")
-    return conn.execute(
-        sql, dict(lon=point[0], lat=point[1], model_name=model, time=time)
+    return execute(
+        conn,
+        "plate-for-point",
+        dict(lon=point[0], lat=point[1], model_name=model, time=time),
     ).scalar()
 
 
@@ -161,11 +254,7 @@ def rotate_point(point, model, time):
     return cart2sph(v1)
 
 
-__tstep_rotation_pairs = get_sql("rotation-pairs-for-time")
-__model_rotation_pairs = get_sql("rotation-pairs-for-model")
-__active_plates_sql = get_sql("active-plates-at-time")
 __model_plates_sql = get_sql("plates-for-model")
-__plate_time_ranges = get_sql("plate-time-ranges")
 
 
 def plates_for_model(model):
@@ -174,7 +263,14 @@ def plates_for_model(model):
 
 
 def get_all_rotations(
-    model, time, verbose=False, active_only=True, plates=None, safe=True, rowset=None
+    model,
+    time,
+    verbose=False,
+    active_only=True,
+    plates=None,
+    safe=True,
+    rowset=None,
+    use_cache=None,
 ):
     """Get all rotations for a model and a timestep
 
@@ -184,22 +280,65 @@ def get_all_rotations(
             The rotation model to use
     time : float
            The time to rotate to, in Myr before present.
+    use_cache : bool
+           Serve rotations from the database rotation cache where
+           possible, computing only those that are not cached.
 
     Yields
     ------
     dict
     """
+    if plates is None and rowset is None:
+        from .grid import get_rotation_grid
+
+        grid = get_rotation_grid(model)
+        if grid is not None and grid.time_index(time) is not None:
+            yield from grid.get_all_rotations(time, active_only=active_only)
+            return
+
     if plates is None:
         if active_only:
-            res = conn.execute(__active_plates_sql, dict(time=time, model_name=model))
+            params = dict(time=time, model_name=model)
+            res = execute(conn, "active-plates-at-time", params)
             plates = [p[0] for p in res]
         else:
             plates = plates_for_model(model)
 
+    if safe:
+        check_model_id(model)
+
+    if use_cache is None:
+        use_cache = use_rotation_cache
+    cached = rotations_from_cache(model, time) if use_cache else {}
+
+    _rowset = None
+    for plate_id in plates:
+        q = cached.get(plate_id)
+        if q is None:
+            if _rowset is None:
+                _rowset = _rowset_for_time(model, time, rowset)
+            q = get_rotation(
+                model,
+                plate_id,
+                time,
+                verbose=verbose,
+                rowset=_rowset,
+                safe=False,
+                use_cache=False,
+            )
+        if q is None:
+            continue
+        if N.isnan(q.w):
+            continue
+        yield plate_id, q
+
+
+def _rowset_for_time(model, time, rowset=None):
+    """Index the rotation pairs for a time, selecting them from `rowset` if
+    it is provided"""
     if rowset is None:
-        _rowset = conn.execute(
-            __tstep_rotation_pairs, dict(time=time, model_name=model)
-        ).fetchall()
+        params = dict(time=time, model_name=model)
+        _rowset = execute(conn, "rotation-pairs-for-time", params).fetchall()
     else:
         _rowset = [
             r
@@ -207,48 +346,12 @@ def get_all_rotations(
             if (r.r1_step == time and r.r2_step is None)
             or (r.r1_step < time and (r.r2_step or -1) > time)
         ]
+    return RowsetIndex(_rowset)
 
-    if safe:
-        check_model_id(model)
-    for plate_id in plates:
-        q = get_rotation(
-            model, plate_id, time, verbose=verbose, rowset=_rowset, safe=False
-        )
-        if q is None:
-            continue
-        if N.isnan(q.w):
-            continue
-        yield plate_id, q
 
+def get_rotation_series(model, *times, verbose=False, **kwargs):
+    """Get rotations for all plates of a model at a series of times, using
+    the in-memory rotation engine (see `RotationModel.get_rotation_series`)"""
+    from .model import get_rotation_model
 
-def get_rotation_series(model, *times, **kwargs):
-    # Pre-compute plates for speed...
-    # LOL this actually makes things slower
-    check_model_id(model)
-
-    plate_ages = conn.execute(
-        __plate_time_ranges,
-        dict(model_name=model),
-    ).fetchall()
-
-    rowset = conn.execute(
-        __model_rotation_pairs,
-        dict(
-            model_name=model,
-            early_age=float(max(times)),
-            late_age=float(min(times)),
-        ),
-    ).fetchall()
-    for t in times:
-        t = float(t)
-        plates = [p.id for p in plate_ages if p.old_lim > t and p.young_lim < t]
-        kwargs["plates"] = plates
-        r = get_all_rotations(model, t, safe=False, rowset=rowset, **kwargs)
-        yield dict(rotations=list(r), time=t)
-
-
-def get_plate_rotations(model, plate_id, verbose=False):
-    time_step = 1
-    time_range = (0, 500)
-    time_steps = range(0, 500, 1)
-    return ((get_rotation(model, plate_id, t), t) for t in time_steps)
+    return get_rotation_model(model).get_rotation_series(*times, **kwargs)
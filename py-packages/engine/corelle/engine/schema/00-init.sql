@@ -1,2 +1,4 @@
 CREATE EXTENSION IF NOT EXISTS postgis;
+-- Scalar columns in GiST indexes of rotation intervals
+CREATE EXTENSION IF NOT EXISTS btree_gist;
 CREATE SCHEMA IF NOT EXISTS corelle;
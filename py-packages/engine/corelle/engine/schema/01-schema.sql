@@ -5,6 +5,11 @@ CREATE TABLE IF NOT EXISTS corelle.model (
   max_age numeric
 );
 
+-- Version stamp, incremented whenever a model's data changes
+ALTER TABLE corelle.model
+  ADD COLUMN IF NOT EXISTS version integer NOT NULL DEFAULT 1,
+  ADD COLUMN IF NOT EXISTS updated timestamptz NOT NULL DEFAULT now();
+
 CREATE TABLE IF NOT EXISTS corelle.plate (
   id integer,
   model_id integer NOT NULL REFERENCES corelle.model(id),
@@ -58,6 +63,34 @@ CREATE TABLE IF NOT EXISTS corelle.rotation (
     ON DELETE CASCADE
 );
 
+CREATE INDEX IF NOT EXISTS rotation_model_time_idx
+  ON corelle.rotation (model_id, t_step);
+
+/* Consecutive rotation steps for each plate and reference plate, which
+rotations at times between the steps are interpolated from. This is kept
+up to date by `corelle.update_rotation_intervals`. */
+CREATE TABLE IF NOT EXISTS corelle.rotation_interval (
+  model_id integer NOT NULL,
+  plate_id integer NOT NULL,
+  ref_plate_id integer NOT NULL,
+  r1_step numeric NOT NULL,
+  r2_step numeric NOT NULL,
+  r1_rotation numeric[] NOT NULL,
+  r2_rotation numeric[] NOT NULL,
+  r1_metadata text,
+  r2_metadata text,
+  -- Times strictly between the two steps
+  valid numrange NOT NULL,
+  PRIMARY KEY (model_id, plate_id, ref_plate_id, r1_step),
+  FOREIGN KEY (plate_id, model_id)
+    REFERENCES corelle.plate (id, model_id)
+    ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS rotation_interval_valid_idx
+  ON corelle.rotation_interval
+  USING gist (model_id, plate_id, valid);
+
 -- Features that can be clipped by plate IDs and returned
 CREATE TABLE IF NOT EXISTS corelle.feature (
   id serial PRIMARY KEY,
@@ -66,15 +99,44 @@ CREATE TABLE IF NOT EXISTS corelle.feature (
   properties jsonb
 );
 
-/* Cache of features pre-converted to GeoJSON (probably should be deprecated!)*/
+/* Older versions cached each dataset for a model as a single GeoJSON blob */
+DO $$
+BEGIN
+  IF EXISTS (
+    SELECT 1
+    FROM information_schema.columns
+    WHERE table_schema = 'corelle'
+      AND table_name = 'feature_cache'
+      AND column_name = 'model_name'
+  ) THEN
+    DROP TABLE corelle.feature_cache;
+  END IF;
+END $$;
+
+/* Cache of features split on each model's plate polygons, with each piece
+pre-converted to a GeoJSON feature */
 CREATE TABLE IF NOT EXISTS corelle.feature_cache (
   model_id integer NOT NULL REFERENCES corelle.model(id),
-  model_name text NOT NULL REFERENCES corelle.model(name),
   dataset_id text NOT NULL,
+  feature_id integer NOT NULL
+    REFERENCES corelle.feature(id)
+    ON DELETE CASCADE,
+  plate_polygon_id integer NOT NULL
+    REFERENCES corelle.plate_polygon(id)
+    ON DELETE CASCADE,
+  plate_id integer NOT NULL,
+  geometry geometry(Geometry, 4326) NOT NULL,
   geojson json NOT NULL,
-  PRIMARY KEY (model_id, dataset_id)
+  PRIMARY KEY (model_id, dataset_id, feature_id, plate_polygon_id)
 );
 
+CREATE INDEX IF NOT EXISTS feature_cache_plate_idx
+  ON corelle.feature_cache (model_id, dataset_id, plate_id);
+
+CREATE INDEX IF NOT EXISTS feature_cache_geometry_idx
+  ON corelle.feature_cache
+  USING gist (geometry);
+
 /* Cache of rotations at various time steps */
 CREATE TABLE IF NOT EXISTS corelle.rotation_cache (
   model_id integer NOT NULL REFERENCES corelle.model(id),
@@ -86,3 +148,29 @@ CREATE TABLE IF NOT EXISTS corelle.rotation_cache (
     REFERENCES corelle.plate (id, model_id)
     ON DELETE CASCADE
 );
+
+CREATE INDEX IF NOT EXISTS rotation_cache_model_time_idx
+  ON corelle.rotation_cache (model_id, t_step);
+
+/* Plate polygons (the `plates` layer) and feature datasets (the `features`
+layer) rotated to cached time steps, as arrays of GeoJSON features */
+CREATE TABLE IF NOT EXISTS corelle.reconstruction_cache (
+  model_id integer NOT NULL REFERENCES corelle.model(id),
+  layer text NOT NULL CHECK (layer IN ('plates', 'features')),
+  dataset_id text NOT NULL DEFAULT '',
+  t_step numeric NOT NULL,
+  geojson json NOT NULL,
+  PRIMARY KEY (model_id, layer, dataset_id, t_step)
+);
+
+-- Precompressed copies of cached GeoJSON payloads, which are sent as-is to
+-- clients that accept them (filled by `corelle compress-payloads`)
+ALTER TABLE corelle.reconstruction_cache
+  ADD COLUMN IF NOT EXISTS geojson_gzip bytea,
+  ADD COLUMN IF NOT EXISTS geojson_br bytea;
+
+CREATE TABLE IF NOT EXISTS corelle.plate_polygon_payload (
+  model_id integer PRIMARY KEY REFERENCES corelle.model(id) ON DELETE CASCADE,
+  geojson_gzip bytea,
+  geojson_br bytea
+);
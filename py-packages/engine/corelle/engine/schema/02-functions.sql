@@ -7,6 +7,53 @@ DROP FUNCTION IF EXISTS corelle.invert_rotation(numeric[]);
 DROP FUNCTION IF EXISTS corelle.rotate_geometry(geometry, double precision[]);
 DROP FUNCTION IF EXISTS corelle.rotate_geometry(geometry,integer,integer,numeric,boolean);
 
+/*
+Rebuild the rotation intervals of a model from its rotations, pairing each
+step with the next step of the same plate and reference plate.
+*/
+CREATE OR REPLACE FUNCTION corelle.update_rotation_intervals(_model_id integer)
+RETURNS void
+AS $$
+  DELETE FROM corelle.rotation_interval WHERE model_id = _model_id;
+
+  INSERT INTO corelle.rotation_interval (
+    model_id, plate_id, ref_plate_id,
+    r1_step, r2_step,
+    r1_rotation, r2_rotation,
+    r1_metadata, r2_metadata,
+    valid
+  )
+  SELECT
+    model_id, plate_id, ref_plate_id,
+    r1_step, r2_step,
+    r1_rotation, r2_rotation,
+    r1_metadata, r2_metadata,
+    numrange(r1_step, r2_step, '()')
+  FROM (
+    SELECT
+      model_id,
+      plate_id,
+      ref_plate_id,
+      t_step r1_step,
+      lead(t_step) OVER w r2_step,
+      ARRAY[longitude, latitude, angle] r1_rotation,
+      lead(ARRAY[longitude, latitude, angle]) OVER w r2_rotation,
+      metadata r1_metadata,
+      lead(metadata) OVER w r2_metadata
+    FROM corelle.rotation
+    WHERE model_id = _model_id
+    WINDOW w AS (PARTITION BY plate_id, ref_plate_id ORDER BY t_step)
+  ) steps
+  WHERE r2_step IS NOT NULL;
+$$ LANGUAGE sql VOLATILE;
+
+-- Build intervals for models imported before they were stored
+SELECT corelle.update_rotation_intervals(m.id)
+FROM corelle.model m
+WHERE NOT EXISTS (
+  SELECT 1 FROM corelle.rotation_interval i WHERE i.model_id = m.id
+);
+
 /*
 Functions to rotate geometries directly in PostGIS. This allows Corelle plate rotations
 to be applied to any geometry in the database. This requires plate geometries to be pre-cached
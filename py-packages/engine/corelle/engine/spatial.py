@@ -0,0 +1,90 @@
+"""
+An in-memory spatial index of plate polygons, for assigning points to
+plates without a round trip to the database.
+"""
+import numpy as N
+import shapely
+from shapely import STRtree
+
+from .query import get_sql
+from .rotate import RotationError
+from .storage import conn, model_version
+
+__plate_polygons = get_sql("plate-polygon-geometries")
+
+
+class PlateIndex:
+    """Plate polygons for a model, indexed with an STRtree.
+
+    Lookups follow the `plate-for-point` query: a polygon contains a
+    point at a time if it intersects the point and
+    `young_lim < time < old_lim` (with a missing `young_lim` treated as
+    zero and a missing `old_lim` never matching).
+    """
+
+    def __init__(self, rows, version=None):
+        rows = list(rows)
+        # Version stamp of the model's data when it was loaded
+        self.version = version
+        self.plate_id = N.array([int(r.plate_id) for r in rows], dtype=int)
+        self.young_lim = N.array([float(r.young_lim) for r in rows])
+        self.old_lim = N.array(
+            [N.nan if r.old_lim is None else float(r.old_lim) for r in rows]
+        )
+        self.geometries = shapely.from_wkb([bytes(r.geometry) for r in rows])
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.plate_id)
+
+    def plate_ids(self, lon, lat, time):
+        """Find the plates containing an array of points at their times.
+
+        Returns an integer array of plate IDs and a mask of which points
+        fall within a plate polygon. Where polygons overlap, the first
+        polygon (in database order) is used.
+        """
+        lon = N.asarray(lon, dtype=float)
+        time = N.broadcast_to(N.asarray(time, dtype=float), lon.shape)
+        plate_ids = N.zeros(len(lon), dtype=int)
+        found = N.zeros(len(lon), dtype=bool)
+        if len(lon) == 0 or len(self) == 0:
+            return plate_ids, found
+
+        points = shapely.points(lon, lat)
+        pt_ix, poly_ix = self.tree.query(points, predicate="intersects")
+
+        t = time[pt_ix]
+        valid = (self.young_lim[poly_ix] < t) & (t < self.old_lim[poly_ix])
+        pt_ix = pt_ix[valid]
+        poly_ix = poly_ix[valid]
+
+        # Keep the first matching polygon for each point
+        order = N.lexsort((poly_ix, pt_ix))
+        pt_ix = pt_ix[order]
+        poly_ix = poly_ix[order]
+        pt_ix, first = N.unique(pt_ix, return_index=True)
+
+        plate_ids[pt_ix] = self.plate_id[poly_ix[first]]
+        found[pt_ix] = True
+        return plate_ids, found
+
+
+def load_plate_index(model_name):
+    """Build a spatial index from a model's plate polygons"""
+    version = model_version(model_name)
+    if version is None:
+        raise RotationError("Unknown model id")
+    res = conn.execute(__plate_polygons, dict(model_name=model_name))
+    return PlateIndex(res.fetchall(), version=version.version)
+
+
+_indexes = {}
+
+
+def get_plate_index(model_name, reload=False):
+    """Get the spatial index of a model's plate polygons, building it on first use"""
+    if reload or model_name not in _indexes:
+        _indexes[model_name] = load_plate_index(model_name)
+    return _indexes[model_name]
@@ -2,16 +2,35 @@
 Mapped database models. These would ideally be in the database module, but
 they need to be here to avoid initialization issues.
 """
-from .database import db
+from sqlalchemy import func, select
+
+from .database import db, connection
 
 _model = db.reflect_table("model", schema="corelle")
 _plate = db.reflect_table("plate", schema="corelle")
 _rotation = db.reflect_table("rotation", schema="corelle")
 _rotation_cache = db.reflect_table("rotation_cache", schema="corelle")
 
-conn = db.engine.connect()
+# Thread-local connection drawn from the pool
+conn = connection
 
 
 def model_id(name):
     stmt = _model.select().where(_model.c.name == name)
     return conn.execute(stmt).scalar()
+
+
+def model_version(name):
+    """A model's version stamp and the time it was last updated, or None if
+    the model doesn't exist"""
+    stmt = select(_model.c.version, _model.c.updated).where(_model.c.name == name)
+    return conn.execute(stmt).first()
+
+
+def bump_model_version(model_id=None):
+    """Mark a model (by default, every model) as changed"""
+    stmt = _model.update().values(version=_model.c.version + 1, updated=func.now())
+    if model_id is not None:
+        stmt = stmt.where(_model.c.id == model_id)
+    conn.execute(stmt)
+    conn.commit()
@@ -0,0 +1,38 @@
+"""
+Tests of thread-scoped connections drawn from a pool.
+"""
+from threading import Barrier, Thread
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from corelle.engine.database import ScopedConnection
+
+
+def test_thread_scoped_connections(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'test.db'}", poolclass=QueuePool, pool_size=2
+    )
+    conn = ScopedConnection(engine)
+    connections = {}
+    barrier = Barrier(3)
+
+    def worker(i):
+        connections[i] = conn.connection
+        # A thread reuses its connection until it is closed
+        assert conn.connection is connections[i]
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        barrier.wait()
+        conn.close()
+
+    threads = [Thread(target=worker, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len({id(c) for c in connections.values()}) == 3
+    stats = conn.stats()
+    assert stats["checkouts"] == 3
+    assert stats["checked_out"] == 0
+    assert stats["size"] == 2
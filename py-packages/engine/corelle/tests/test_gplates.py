@@ -3,6 +3,7 @@ import numpy as N
 
 from corelle.math import quaternion_to_euler, euler_equal
 from corelle.engine.rotate import get_rotation, rotate_point
+from corelle.engine.reconstruct import reconstruct_points
 
 from .utils import get_geojson, get_coordinates, fixture_file
 
@@ -14,6 +15,14 @@ def test_against_web_service(gplates_web_service_testcase):
         assert N.allclose(p1, ct, atol=0.01)
 
 
+@pytest.mark.parametrize("use_index", [False, True])
+def test_batch_against_web_service(gplates_web_service_testcase, use_index):
+    case = gplates_web_service_testcase
+    lon, lat = N.array(case.current).T
+    res = reconstruct_points(case.model, lon, lat, case.time, use_index=use_index)
+    assert N.allclose(N.column_stack([res["lon"], res["lat"]]), case.rotated, atol=0.01)
+
+
 def test_against_gplates_web_service_africa():
     time = 140
     req = get_geojson("seton2012-gws-request-africa")
@@ -0,0 +1,46 @@
+"""
+Tests of memory-mapped rotation grids.
+"""
+import numpy as N
+
+from corelle.engine import grid as grids
+from corelle.engine.grid import RotationGrid, export_rotation_grid, get_rotation_grid
+from corelle.engine.model import get_rotation_model
+
+
+def test_rotation_grid(tmp_path):
+    """Rotations read from an exported grid should match computed rotations"""
+    times = [0, 5, 67, 120, 200]
+    path = export_rotation_grid("Seton2012", times, path=tmp_path / "Seton2012")
+    grid = RotationGrid(path)
+    assert isinstance(grid.rotations, N.memmap)
+
+    model = get_rotation_model("Seton2012")
+    for time in times:
+        expected = dict(model.get_all_rotations(time))
+        res = dict(grid.get_all_rotations(time))
+        assert res.keys() == expected.keys()
+        for plate_id, q in res.items():
+            assert N.allclose(q, expected[plate_id])
+            assert N.allclose(grid.get_rotation(plate_id, time), q)
+
+    # Rotation series have their own active plates
+    (step,) = model.get_rotation_series(120)
+    res = dict(grid.get_all_rotations(120, series=True))
+    assert res.keys() == dict(step["rotations"]).keys()
+
+    # Times that aren't on the grid aren't served
+    assert grid.time_index(10) is None
+    assert list(grid.get_all_rotations(10)) == []
+
+
+def test_stale_rotation_grid(tmp_path, monkeypatch):
+    """Grids exported from an older version of a model are not used"""
+    monkeypatch.setattr(grids, "grid_dir", str(tmp_path))
+    path = export_rotation_grid("Seton2012", [0, 10])
+    grid = get_rotation_grid("Seton2012", reload=True)
+    assert grid is not None
+    assert grid.version == get_rotation_model("Seton2012").version
+
+    N.save(path / "version.npy", N.array(grid.version - 1))
+    assert get_rotation_grid("Seton2012", reload=True) is None
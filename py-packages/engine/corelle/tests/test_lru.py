@@ -0,0 +1,66 @@
+from threading import Thread
+
+from corelle.engine.lru import LRUCache
+
+
+def test_lru_eviction():
+    cache = LRUCache(max_entries=3)
+    for i in range(3):
+        cache.set(("Seton2012", i, 0.0), i)
+    # Touch the oldest entry so that it is not evicted
+    assert cache.get(("Seton2012", 0, 0.0)) == 0
+    cache.set(("Seton2012", 3, 0.0), 3)
+    assert ("Seton2012", 0, 0.0) in cache
+    assert ("Seton2012", 1, 0.0) not in cache
+    assert len(cache) == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_none():
+    cache = LRUCache(max_entries=10)
+    missing = object()
+    assert cache.get(("Seton2012", 1, 10.0), missing) is missing
+    cache.set(("Seton2012", 1, 10.0), None)
+    assert cache.get(("Seton2012", 1, 10.0), missing) is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_byte_limit():
+    cache = LRUCache(max_bytes=2000)
+    for i in range(100):
+        cache.set(("Seton2012", i, 0.0), float(i))
+    assert 0 < len(cache) < 100
+    assert cache.bytes <= 2000
+
+
+def test_model_invalidation():
+    cache = LRUCache(max_entries=100)
+    for i in range(10):
+        cache.set(("Seton2012", i, 0.0), i)
+        cache.set(("Wright2013", i, 0.0), i)
+    assert cache.invalidate("Seton2012") == 10
+    assert len(cache) == 10
+    assert cache.stats()["models"] == ["Wright2013"]
+    cache.invalidate()
+    assert len(cache) == 0
+    assert cache.bytes == 0
+
+
+def test_thread_safety():
+    cache = LRUCache(max_entries=50)
+
+    def work(n):
+        for i in range(1000):
+            key = ("Seton2012", (n * i) % 80, 0.0)
+            if key not in cache:
+                cache.set(key, i)
+
+    threads = [Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(cache) <= 50
+    assert sum(cache._sizes.values()) == cache.bytes
@@ -2,11 +2,13 @@ import pytest
 import numpy as N
 
 from corelle.math import euler_equal, quaternion_to_euler, euler_to_quaternion
+from collections import namedtuple
 from corelle.engine.rotate import (
     get_rotation,
     get_all_rotations,
     get_rotation_series,
     RotationError,
+    RowsetIndex,
 )
 
 
@@ -152,3 +154,21 @@ def test_rotation_series_speed():
     times = N.arange(350, 0, -1)
     res = list(get_rotation_series("Seton2012", *times))
     assert res[0]["time"] == 350
+
+
+def test_rowset_index():
+    """Indexed rowsets should return the first matching pair for a plate"""
+    Pair = namedtuple("Pair", ["plate_id", "ref_plate_id", "r1_step"])
+    rowset = [
+        Pair(203, 201, 0),
+        Pair(203, 926, 53.3),
+        Pair(701, 0, 10),
+        Pair(701, 0, 5),
+    ]
+    index = RowsetIndex(rowset)
+    assert len(index) == 4
+    assert index.find(203, 67).ref_plate_id == 201
+    assert index.find(701, 7).r1_step == 5
+    assert index.find(701, 12).r1_step == 10
+    assert index.find(701, 2) is None
+    assert index.find(802, 10) is None
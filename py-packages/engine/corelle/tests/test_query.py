@@ -0,0 +1,42 @@
+"""
+Tests of the query registry and prepared statements.
+"""
+from corelle.engine.query import get_sql, prepare_sql, execute
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.info = {}
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(str(sql))
+
+
+def test_queries_are_loaded_once():
+    assert get_sql("plate-for-point") is get_sql("plate-for-point")
+
+
+def test_prepare_sql():
+    sql = prepare_sql("plate-for-point")
+    assert sql.startswith("PREPARE corelle_plate_for_point (text, double precision")
+    assert "ST_MakePoint($2, $3)" in sql
+    # Comments are removed, and casts are not mistaken for parameters
+    sql = prepare_sql("plates-for-points")
+    assert "(double precision[], double precision[], double precision[], text)" in sql
+    assert "CAST($1 AS double precision[])" in sql
+    sql = prepare_sql("rotation-pairs-for-time")
+    assert ":" not in sql
+    assert "$2" in sql
+
+
+def test_statements_are_prepared_once_per_connection():
+    conn = RecordingConnection()
+    params = dict(model_name="Seton2012", time=10)
+    for i in range(3):
+        execute(conn, "active-plates-at-time", params)
+    assert conn.statements[0].startswith("PREPARE corelle_active_plates_at_time")
+    assert (
+        conn.statements[1:]
+        == ["EXECUTE corelle_active_plates_at_time (:model_name, :time)"] * 3
+    )
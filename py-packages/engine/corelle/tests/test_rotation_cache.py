@@ -0,0 +1,92 @@
+"""
+Tests of rotations served from the database rotation cache.
+"""
+import pytest
+import numpy as N
+from collections import namedtuple
+
+from corelle.engine.cache import (
+    build_rotation_cache,
+    cached_rotations,
+    changed_intervals,
+)
+from corelle.engine.storage import conn, _model, _rotation_cache
+from corelle.engine.rotate import get_all_rotations, reset_cache
+
+model_name = "Wright2013"
+
+
+@pytest.fixture(scope="module")
+def rotation_cache():
+    """The model's rotation cache, rebuilt for these tests. The previously
+    cached rows and version stamp are restored afterwards."""
+    model = conn.execute(_model.select().where(_model.c.name == model_name)).first()
+    where = _rotation_cache.c.model_id == model.id
+    rows = [
+        dict(r._mapping) for r in conn.execute(_rotation_cache.select().where(where))
+    ]
+    assert build_rotation_cache(model) > 0
+    yield
+    conn.execute(_rotation_cache.delete().where(where))
+    if rows:
+        conn.execute(_rotation_cache.insert(), rows)
+    stamp = dict(version=model.version, updated=model.updated)
+    conn.execute(_model.update().where(_model.c.id == model.id).values(**stamp))
+    conn.commit()
+    reset_cache(model_name)
+
+
+@pytest.mark.parametrize("time", [0, 10, 120, 240])
+def test_cached_rotations(rotation_cache, time):
+    """Rotations on the cached grid should match computed rotations"""
+    expected = dict(get_all_rotations(model_name, time, use_cache=False))
+    res = cached_rotations(model_name, time)
+    for plate_id, q in expected.items():
+        if plate_id in res:
+            assert N.allclose(res[plate_id], q)
+
+
+def test_interpolated_rotations(rotation_cache):
+    """Rotations between cached steps are interpolated, unless the steps are
+    further apart than the tolerance"""
+    expected = dict(get_all_rotations(model_name, 120.5, use_cache=False))
+    res = cached_rotations(model_name, 120.5)
+    assert len(res) > 0
+    for plate_id, q in res.items():
+        assert (q * expected[plate_id].conjugate()).angle() < N.radians(1)
+    assert cached_rotations(model_name, 120.5, tolerance=0.5) == {}
+
+
+def test_get_all_rotations_from_cache(rotation_cache):
+    reset_cache(model_name)
+    expected = dict(get_all_rotations(model_name, 120, use_cache=False))
+    reset_cache(model_name)
+    res = dict(get_all_rotations(model_name, 120, use_cache=True))
+    assert res.keys() == expected.keys()
+    for plate_id, q in res.items():
+        assert N.allclose(q, expected[plate_id])
+
+
+def test_changed_intervals():
+    """Changed rotation steps affect their plate between neighbouring steps,
+    and all plates that descend from it"""
+    Row = namedtuple(
+        "Row", ["plate_id", "ref_plate_id", "t_step", "latitude", "longitude", "angle"]
+    )
+    old = [
+        Row(1, 0, 0, 0, 0, 0),
+        Row(1, 0, 10, 5, 5, 5),
+        Row(1, 0, 20, 6, 6, 6),
+        Row(2, 1, 0, 0, 0, 0),
+        Row(2, 1, 50, 1, 1, 1),
+        Row(4, 0, 0, 0, 0, 0),
+        Row(4, 0, 30, 1, 1, 1),
+    ]
+    assert changed_intervals(old, old) == {}
+
+    new = list(old)
+    new[1] = Row(1, 0, 10, 5, 5, 5.1)
+    assert changed_intervals(old, new) == {1: [(0, 20)], 2: [(0, 20)]}
+
+    new = old + [Row(4, 0, 15, 1, 1, 1)]
+    assert changed_intervals(old, new) == {4: [(0, 30)]}
@@ -0,0 +1,103 @@
+"""
+Tests of the in-memory rotation engine, which should give the same results
+as the recursive, database-backed functions in `corelle.engine.rotate`.
+"""
+import pytest
+import numpy as N
+from collections import namedtuple
+
+from corelle.engine.model import RotationModel, get_rotation_model
+from corelle.engine.rotate import get_rotation, get_all_rotations, RotationError
+
+
+def test_unknown_model():
+    with pytest.raises(RotationError):
+        get_rotation_model("Adsdfs")
+
+
+def test_recursion():
+    model = get_rotation_model("Seton2012")
+    assert model.get_rotation(502, 130) is not None
+    assert get_rotation_model("Wright2013").get_rotation(601, 160) is not None
+
+
+@pytest.mark.parametrize("plate_id", [1, 201, 417, 701, 802])
+@pytest.mark.parametrize("time", [0, 2, 9.8, 67, 152, 200, 318])
+def test_matches_database_rotations(plate_id, time):
+    q0 = get_rotation("Seton2012", plate_id, time)
+    q1 = get_rotation_model("Seton2012").get_rotation(plate_id, time)
+    if q0 is None:
+        assert q1 is None
+    else:
+        assert N.allclose(q0, q1)
+
+
+@pytest.mark.parametrize("time", [0, 10, 120, 240])
+def test_all_rotations(time):
+    expected = dict(get_all_rotations("Seton2012", time))
+    res = dict(get_rotation_model("Seton2012").get_all_rotations(time))
+    assert res.keys() == expected.keys()
+    for plate_id, q in res.items():
+        assert N.allclose(q, expected[plate_id])
+
+
+def test_rotation_series():
+    times = N.arange(350, 340, -1)
+    model = get_rotation_model("Seton2012")
+    for time, rot in zip(times, model.get_rotation_series(*times)):
+        assert rot["time"] == time
+        assert len(rot["rotations"]) == len(list(model.get_all_rotations(time)))
+
+
+def test_rotation_arrays():
+    """Batched rotations should match rotations resolved one plate at a time"""
+    model = get_rotation_model("Seton2012")
+    plate_ids, rotations = model.rotation_arrays(130, active_only=False)
+    assert len(plate_ids) == len(rotations)
+    for plate_id, q in zip(plate_ids, rotations):
+        assert N.allclose(q, model.get_rotation(plate_id, 130))
+    # Plates without a rotation are omitted
+    for plate_id in set(model.plates) - set(plate_ids.tolist()):
+        assert model.get_rotation(plate_id, 130) is None
+
+
+def test_rotation_series_arrays():
+    """Rotations computed for a whole series should match single time steps"""
+    model = get_rotation_model("Seton2012")
+    times = [200, 152.5, 67, 9.8, 9.8, 0]
+    series = model.get_rotation_series(*times, active_only=False, chunk_size=4)
+    for time, rot in zip(times, series):
+        assert rot["time"] == time
+        plate_ids, rotations = model.rotation_arrays(time, active_only=False)
+        assert [p for p, _ in rot["rotations"]] == plate_ids.tolist()
+        for (_, q0), q1 in zip(rot["rotations"], rotations):
+            assert N.allclose(q0, q1)
+
+
+def test_missing_plate_time_limits():
+    """Rotation series treat missing polygon time limits as the present day and
+    4500 Ma, while plates at a single time need both limits"""
+    Rotation = namedtuple(
+        "Rotation", ["plate_id", "ref_plate_id", "t_step", "rotation"]
+    )
+    Range = namedtuple("Range", ["id", "young_lim", "old_lim"])
+    rotations = [Rotation(p, 0, t, [0, 90, t / 10]) for p in (1, 2) for t in (0, 100)]
+    ranges = [Range(1, None, None), Range(2, 0, 200)]
+    model = RotationModel("test", rotations, ranges)
+
+    assert model.active_plates(50) == [2]
+    (step,) = model.get_rotation_series(50)
+    assert [plate_id for plate_id, _ in step["rotations"]] == [1, 2]
+
+
+@pytest.mark.parametrize("plate_id", [0, 201, 701, 99999])
+def test_plate_rotation_series(plate_id):
+    """A plate's pole path should match rotations resolved one time at a time"""
+    model = get_rotation_model("Seton2012")
+    times = N.arange(0, 200, 2.5)
+    rotations, resolved = model.plate_rotation_series(plate_id, times)
+    for time, q, ok in zip(times, rotations, resolved):
+        q0 = model.get_rotation(plate_id, time)
+        assert ok == (q0 is not None)
+        if ok:
+            assert N.allclose(q, q0)
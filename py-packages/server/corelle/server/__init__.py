@@ -1,25 +1,177 @@
-from flask import Flask
-from flask_restful import Resource, Api
+from functools import wraps
+from hashlib import sha1
+from io import BytesIO
+from os import environ
+from time import monotonic
+
+from flask import Flask, Response, request, stream_with_context
+from flask_restful import Resource, Api, abort, inputs
 from flask_restful.reqparse import RequestParser
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import (
+    http_date,
+    parse_accept_header,
+    parse_date,
+    parse_etags,
+    quote_etag,
+)
 from sqlalchemy import text
-from simplejson import loads, JSONEncoder
+from simplejson import dumps, loads, JSONEncoder
 import numpy as N
+import quaternion as Q
 
-from corelle.engine.database import db
+from corelle.engine.database import connection, env_int
 from corelle.engine.query import get_sql
 from corelle.engine.rotate import (
-    get_rotation,
+    cache,
+    use_rotation_cache,
     get_all_rotations,
-    get_plate_rotations,
-    get_rotation_series,
-    rotate_point,
+    get_rotation,
 )
+from corelle.engine.model import get_rotation_model, _models
+from corelle.engine.grid import get_rotation_grid
+from corelle.engine.spatial import _indexes
+from corelle.engine.storage import model_version
+from corelle.engine.reconstruct import reconstruct_plate_polygons, reconstruct_points
+from corelle.engine.lru import LRUCache
 
 app = Flask(__name__)
 app.config["RESTFUL_JSON"] = dict(cls=JSONEncoder)
 api = Api(app)
 
-conn = db.engine.connect()
+# Connections are scoped to the thread handling a request, and returned to
+# the pool when the request ends
+conn = connection
+
+
+@app.teardown_appcontext
+def release_connection(exc=None):
+    conn.close()
+
+
+# Seconds that clients and proxies may reuse responses before revalidating
+http_cache_max_age = int(environ.get("CORELLE_HTTP_CACHE_MAX_AGE", 300))
+
+# Seconds that a model's version stamp is reused before the database is
+# checked again
+version_ttl = float(environ.get("CORELLE_MODEL_VERSION_TTL", 5))
+
+_versions = {}
+_version_checks = {}
+
+# Plate polygons reconstructed to times that aren't in the reconstruction
+# cache, or simplified, keyed by model, time and tolerance
+plate_cache = LRUCache(
+    max_entries=env_int("CORELLE_PLATE_CACHE_ENTRIES", 100),
+    max_bytes=env_int("CORELLE_PLATE_CACHE_BYTES"),
+)
+
+
+def current_version(model_name):
+    """Get a model's version stamp. Models, plate indexes and rotations cached
+    in memory are discarded when the version changes (i.e. the model is
+    re-imported), including those loaded before the first versioned request.
+
+    The stamp is only read from the database once every `version_ttl`
+    seconds, so changes may take that long to be noticed."""
+    checked_at, res = _version_checks.get(model_name, (None, None))
+    if checked_at is None or monotonic() - checked_at >= version_ttl:
+        res = model_version(model_name)
+        _version_checks[model_name] = (monotonic(), res)
+    if res is None:
+        return None
+    if _versions.get(model_name) != res.version:
+        # Cached rotations don't record a version, so they are discarded when
+        # the version changes and the first time that a model is checked
+        cache.invalidate(model_name)
+        plate_cache.invalidate(model_name)
+        get_rotation_grid(model_name, reload=True)
+        _versions[model_name] = res.version
+    # Models and plate indexes may have been loaded (by requests that aren't
+    # versioned) before the version changed
+    for loaded in (_models, _indexes):
+        current = loaded.get(model_name)
+        if current is not None and current.version != res.version:
+            loaded.pop(model_name, None)
+    return res
+
+
+def versioned(method):
+    """Add cache validators to responses that depend only on a model and the
+    query parameters, and answer conditional requests with 304 Not Modified.
+
+    The ETag combines the model's version stamp with the request path and
+    query parameters, so it changes whenever the model is re-imported.
+    """
+
+    @wraps(method)
+    def wrapper(*args, **kwargs):
+        model_name = request.args.get("model")
+        if request.method not in ("GET", "HEAD") or model_name is None:
+            return method(*args, **kwargs)
+        version = current_version(model_name)
+        if version is None:
+            return method(*args, **kwargs)
+
+        fmt = response_format(request.args.get("format"), request.headers.get("Accept"))
+        tag, headers = cache_validators(
+            request.path, request.args.items(multi=True), *version, variant=fmt
+        )
+        if not_modified(request.headers, tag, version.updated):
+            return Response(status=304, headers=headers)
+
+        res = method(*args, **kwargs)
+        if isinstance(res, Response):
+            res.headers.extend(headers)
+            return res
+        return res, 200, headers
+
+    return wrapper
+
+
+# Response formats, which can be chosen with the `format` parameter or the
+# Accept header (JSON by default)
+formats = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "npy": "application/x-npy",
+}
+
+
+def response_format(format=None, accept=None):
+    """The name of the format requested by the `format` parameter or the
+    Accept header"""
+    if format is not None:
+        return format
+    mimetype = parse_accept_header(accept, MIMEAccept).best_match(
+        formats.values(), default=formats["json"]
+    )
+    return next(k for k, v in formats.items() if v == mimetype)
+
+
+def cache_validators(path, args, version, updated, variant="json"):
+    """An entity tag for a request and the caching headers of its response.
+    Responses in each format (`variant`) have different tags."""
+    params = sorted(f"{k}={v}" for k, v in args)
+    key = "\n".join([path, variant, *params])
+    tag = f"{version}-{sha1(key.encode('utf-8')).hexdigest()[:20]}"
+    headers = {
+        "ETag": quote_etag(tag, weak=True),
+        "Last-Modified": http_date(updated),
+        "Cache-Control": f"public, max-age={http_cache_max_age}",
+        "Vary": "Accept, Accept-Encoding",
+    }
+    return tag, headers
+
+
+def not_modified(headers, tag, updated):
+    """Check the conditional headers of a request against a response"""
+    # If-None-Match takes precedence over If-Modified-Since
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        return parse_etags(if_none_match).contains_weak(tag)
+    since = parse_date(headers.get("If-Modified-Since"))
+    return since is not None and updated.replace(microsecond=0) <= since
 
 
 class Help(Resource):
@@ -42,11 +194,46 @@ def get_plate_polygons(model):
 
 
 def get_plate_polygons_cached(model):
+    """Cached modern plate polygons, as the JSON text stored in the database"""
     q = get_sql("modern-plate-polygons-cached")
     return conn.execute(q, dict(model_name=model)).scalar()
 
 
+# Encodings of precompressed payloads, in order of preference
+compressed_encodings = ("br", "gzip")
+
+
+def accepted_encodings(accept):
+    """Encodings of precompressed payloads that a client accepts, most
+    preferred first"""
+    encodings = [e for e in compressed_encodings if accept[e] > 0]
+    return sorted(encodings, key=lambda e: -accept[e])
+
+
+def compressed_response(query, params):
+    """Send a stored, precompressed copy of a JSON payload in an encoding that
+    the client accepts. Returns None if no such copy has been stored."""
+    encodings = accepted_encodings(request.accept_encodings)
+    if not encodings:
+        return None
+    res = conn.execute(query, dict(params, encodings=encodings)).first()
+    if res is None:
+        return None
+    return Response(
+        bytes(res.data),
+        mimetype="application/json",
+        headers={"Content-Encoding": res.encoding},
+    )
+
+
+def json_response(payload):
+    """Send JSON text from the database without decoding and re-encoding it"""
+    return Response("null" if payload is None else payload, mimetype="application/json")
+
+
 class ModelResource(Resource):
+    method_decorators = [versioned]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.parser = RequestParser()
@@ -59,17 +246,167 @@ class AllFeatures(Resource):
         return [r[0] for r in conn.execute(q)]
 
 
+_cached_features = get_sql("feature-dataset-cached")
+
+
+def stream_json_array(result, batch_size=1000):
+    """Stream rows of JSON text as a JSON array"""
+    sep = "["
+    for rows in result.partitions(batch_size):
+        yield sep + ",".join(r[0] for r in rows)
+        sep = ","
+    yield "[]" if sep == "[" else "]"
+
+
+def feature_query_params(dataset, model, bbox, plate_id, page, page_size):
+    """Parameters of the `feature-dataset-cached` query for a request"""
+    if bbox is not None:
+        try:
+            bbox = [float(v) for v in bbox.split(",")]
+        except ValueError:
+            bbox = None
+        if bbox is None or len(bbox) != 4:
+            raise ValueError("`bbox` must be min_lon,min_lat,max_lon,max_lat")
+    if (page_size is not None and page_size <= 0) or page < 0:
+        raise ValueError("`page_size` must be positive and `page` non-negative")
+    if page > 0 and page_size is None:
+        raise ValueError("`page_size` is required with `page`")
+    return dict(
+        model_name=model,
+        dataset=dataset,
+        plate_id=plate_id,
+        bbox=bbox,
+        limit=page_size,
+        offset=page * page_size if page_size is not None else 0,
+    )
+
+
 class Features(ModelResource):
+    """
+    Features of a dataset, split on a model's plate polygons. These can be
+    filtered to a bounding box (`bbox=min_lon,min_lat,max_lon,max_lat`) and
+    to one or more `plate_id`s, and paged using `page` and `page_size`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parser.add_argument("bbox", type=str)
+        self.parser.add_argument("plate_id", type=int, action="append")
+        self.parser.add_argument("page", type=int, default=0)
+        self.parser.add_argument("page_size", type=int)
+
     def get(self, dataset):
         args = self.parser.parse_args()
-        q = get_sql("feature-dataset-cached")
-        return conn.execute(q, dict(model_name=args["model"], dataset=dataset)).scalar()
+        try:
+            params = feature_query_params(dataset, **args)
+        except ValueError as err:
+            abort(400, message=str(err))
+        # Features are streamed from a server-side cursor, so large datasets
+        # are never held in memory at once
+        res = conn.execute(
+            _cached_features, params, execution_options=dict(stream_results=True)
+        )
+        return Response(
+            stream_with_context(stream_json_array(res)), mimetype="application/json"
+        )
+
+
+_cached_reconstruction = get_sql("reconstruction-cached")
+_compressed_reconstruction = get_sql("reconstruction-compressed")
+
+
+class Reconstruction(ModelResource):
+    """
+    Plate polygons, or the features of a dataset, rotated to a time. These
+    are served from the cache built by `corelle cache-reconstructions`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parser.add_argument("time", type=float, required=True)
+
+    def get(self, dataset=None):
+        args = self.parser.parse_args()
+        params = dict(
+            model_name=args["model"],
+            layer="plates" if dataset is None else "features",
+            dataset_id=dataset or "",
+            time=args["time"],
+        )
+        res = compressed_response(_compressed_reconstruction, params)
+        if res is not None:
+            return res
+        res = conn.execute(_cached_reconstruction, params).scalar()
+        if res is None:
+            abort(404, message=f"No reconstruction is cached for {args['time']} Ma")
+        return json_response(res)
+
+
+_compressed_plates = get_sql("modern-plate-polygons-compressed")
 
 
 class ModernPlates(ModelResource):
+    """
+    A model's plate polygons, or with `time`, the polygons rotated to that
+    time. Polygons can be simplified to within a `tolerance` (in degrees).
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parser.add_argument("time", type=float)
+        self.parser.add_argument("tolerance", type=float)
+
     def get(self):
         args = self.parser.parse_args()
-        return get_plate_polygons_cached(args["model"])
+        model, time, tolerance = args["model"], args["time"], args["tolerance"]
+        if tolerance is not None and tolerance < 0:
+            abort(400, message="`tolerance` must not be negative")
+        if tolerance == 0:
+            tolerance = None
+
+        if time is None and tolerance is None:
+            res = compressed_response(_compressed_plates, dict(model_name=model))
+            if res is not None:
+                return res
+            return json_response(get_plate_polygons_cached(model))
+
+        if tolerance is None:
+            # Use the reconstruction cache if the time has been cached
+            params = dict(model_name=model, layer="plates", dataset_id="", time=time)
+            res = compressed_response(_compressed_reconstruction, params)
+            if res is not None:
+                return res
+            res = conn.execute(_cached_reconstruction, params).scalar()
+            if res is not None:
+                return json_response(res)
+
+        key = (model, time, tolerance)
+        res = plate_cache.get(key)
+        if res is None:
+            res = reconstruct_plate_polygons(model, time, tolerance)
+            plate_cache.set(key, res)
+        return json_response(res)
+
+
+def rotation_records(rotations, time, precision=64):
+    """Pack (plate_id, quaternion) pairs into a structured array of
+    little-endian `time`, `plate_id` and `quaternion` (w, x, y, z) fields"""
+    dtype = N.dtype(
+        [("time", "<f8"), ("plate_id", "<i4"), ("quaternion", f"<f{precision//8}", 4)]
+    )
+    plate_id, q = zip(*rotations) if rotations else ((), ())
+    res = N.empty(len(plate_id), dtype=dtype)
+    res["time"] = time
+    res["plate_id"] = plate_id
+    res["quaternion"] = Q.as_float_array(N.array(q, dtype=N.quaternion)).reshape(-1, 4)
+    return res
+
+
+def npy_response(records):
+    """Send a structured array in NumPy's `.npy` format"""
+    buf = BytesIO()
+    N.save(buf, records, allow_pickle=False)
+    return Response(buf.getvalue(), mimetype=formats["npy"])
 
 
 def base_parser():
@@ -81,6 +418,8 @@ def base_parser():
 
 
 class RotationsResource(Resource):
+    method_decorators = [versioned]
+
     def __init__(self):
         super().__init__()
         self.parser = base_parser()
@@ -95,6 +434,8 @@ class Rotation(RotationsResource):
     def __init__(self):
         super().__init__()
         self.parser.add_argument("time", required=True)
+        self.parser.add_argument("format", choices=("json", "npy"))
+        self.parser.add_argument("precision", type=int, choices=(32, 64), default=64)
 
     def reducer(self, q, args, plate_id):
         res = super().reducer(q, args)
@@ -104,19 +445,50 @@ class Rotation(RotationsResource):
     def get(self):
         args = self.parser.parse_args()
 
+        if response_format(args["format"], request.headers.get("Accept")) == "npy":
+            if args["plate_id"]:
+                q = self.rotation(args)
+                rotations = [] if q is None else [(args["plate_id"], q)]
+            else:
+                rotations = list(self.rotations(args))
+            time = float(args["time"])
+            return npy_response(rotation_records(rotations, time, args["precision"]))
+
         if args["plate_id"]:
             return self.get_single(args)
 
         return list(self.get_all(args))
 
+    def rotations(self, args):
+        grid = get_rotation_grid(args["model"])
+        if grid is not None and grid.time_index(args["time"]) is not None:
+            rotations = grid.get_all_rotations(args["time"])
+        elif use_rotation_cache:
+            # Serve from the database rotation cache without loading the model
+            rotations = get_all_rotations(args["model"], float(args["time"]))
+        else:
+            model = get_rotation_model(args["model"])
+            rotations = model.get_all_rotations(args["time"])
+        return rotations
+
     def get_all(self, args):
-        for plate_id, q in get_all_rotations(args["model"], args["time"]):
+        for plate_id, q in self.rotations(args):
             yield self.reducer(q, args, plate_id)
 
-    def get_single(self, args):
+    def rotation(self, args):
         plate_id = args["plate_id"]
-        q = get_rotation(args["model"], plate_id, args["time"])
-        return self.reducer(q, args, plate_id)
+        grid = get_rotation_grid(args["model"])
+        if grid is not None and grid.time_index(args["time"]) is not None:
+            q = grid.get_rotation(plate_id, args["time"])
+        elif use_rotation_cache:
+            q = get_rotation(args["model"], plate_id, float(args["time"]))
+        else:
+            model = get_rotation_model(args["model"])
+            q = model.get_rotation(plate_id, args["time"])
+        return q
+
+    def get_single(self, args):
+        return self.reducer(self.rotation(args), args, args["plate_id"])
 
 
 class RotationSeries(RotationsResource):
@@ -127,6 +499,8 @@ class RotationSeries(RotationsResource):
         self.parser.add_argument("time_start", required=True)
         self.parser.add_argument("time_end", required=True, default=0)
         self.parser.add_argument("interval", required=True)
+        self.parser.add_argument("format", choices=("json", "ndjson", "npy"))
+        self.parser.add_argument("precision", type=int, choices=(32, 64), default=64)
 
     def reducer(self, q, args, plate_id):
         res = super().reducer(q, args)
@@ -135,47 +509,124 @@ class RotationSeries(RotationsResource):
 
     def get(self):
         args = self.parser.parse_args()
+        fmt = response_format(args["format"], request.headers.get("Accept"))
+        if fmt == "ndjson":
+            # Stream one time step per line as it is computed
+            lines = (dumps(vals) + "\n" for vals in self.get_all(args))
+            return Response(stream_with_context(lines), mimetype=formats["ndjson"])
+        if fmt == "npy":
+            # All time steps in a single array, ordered by time
+            records = [
+                rotation_records(vals["rotations"], vals["time"], args["precision"])
+                for vals in self.series(args)
+            ]
+            if len(records) == 0:
+                records.append(rotation_records([], 0, args["precision"]))
+            return npy_response(N.concatenate(records))
         return list(self.get_all(args))
 
-    def get_all(self, args):
+    def series(self, args):
         ages = N.arange(
             float(args["time_start"]), float(args["time_end"]), -float(args["interval"])
         )
-        for vals in get_rotation_series(args["model"], *ages):
+        grid = get_rotation_grid(args["model"])
+        if grid is not None and all(grid.time_index(t) is not None for t in ages):
+            series = (
+                dict(
+                    rotations=list(grid.get_all_rotations(t, series=True)),
+                    time=float(t),
+                )
+                for t in ages
+            )
+        else:
+            series = get_rotation_model(args["model"]).get_rotation_series(*ages)
+        return series
+
+    def get_all(self, args):
+        for vals in self.series(args):
             vals["rotations"] = [
                 self.reducer(q, args, plate_id) for plate_id, q in vals["rotations"]
             ]
             yield vals
 
 
-class Pole(ModelResource):
+class Pole(RotationsResource):
     """
-    Get poles for plate(s)
+    Get the path of a plate's pole over a range of times. Times run from
+    `time_start` (default: the model's minimum age) towards `time_end`
+    (default: the model's maximum age) every `interval` Myr. With `compact`,
+    the path is returned as arrays rather than a list of steps.
     """
 
+    max_steps = 100000
+
     def __init__(self):
         super().__init__()
-        self.parser.add_argument("plate_id", type=int, required=True)
+        self.parser.replace_argument("plate_id", type=int, required=True)
+        self.parser.add_argument("time_start", type=float)
+        self.parser.add_argument("time_end", type=float)
+        self.parser.add_argument("interval", type=float, default=1)
+        self.parser.add_argument("compact", type=inputs.boolean, default=False)
 
     def get(self):
         args = self.parser.parse_args()
-        id = args["plate_id"]
-        return list(self.get_single(id, args))
-
-    def get_single(self, id, args):
-        for q, t_step in get_plate_rotations(args["model"], id):
-            yield self.reducer(q, args, t_step)
+        model = get_rotation_model(args["model"])
+        times = self.time_steps(model, args)
+        q, resolved = model.plate_rotation_series(args["plate_id"], times)
+        times, q = times[resolved], q[resolved]
+        if args["compact"]:
+            return self.compact(q, args, times)
+        return [self.reducer(q_, args, t) for q_, t in zip(q, times.tolist())]
+
+    def time_steps(self, model, args):
+        start = args["time_start"]
+        if start is None:
+            start = model.min_age or 0
+        end = args["time_end"]
+        if end is None:
+            end = model.max_age or 500
+        interval = args["interval"]
+        if not interval > 0:
+            abort(400, message="`interval` must be positive")
+        if abs(end - start) / interval > self.max_steps:
+            abort(400, message=f"Pole paths are limited to {self.max_steps} steps")
+        return N.arange(start, end, interval if end >= start else -interval)
 
     def reducer(self, q, args, t_step):
         res = super().reducer(q, args)
         res["t_step"] = t_step
         return res
 
+    def compact(self, q, args, times):
+        arr = Q.as_float_array(q).reshape(-1, 4)
+        res = dict(plate_id=args["plate_id"], t_step=times.tolist())
+        if args["quaternion"]:
+            res["quaternion"] = arr.tolist()
+        else:
+            res["axis"] = arr[:, 1:].tolist()
+            angle = 2 * N.arctan2(N.linalg.norm(arr[:, 1:], axis=1), arr[:, 0])
+            res["angle"] = angle.tolist()
+        return res
+
+
+class CacheStats(Resource):
+    """Statistics for the in-memory rotation cache"""
+
+    def get(self):
+        return cache.stats()
+
+
+class PoolStats(Resource):
+    """Statistics for the database connection pool"""
+
+    def get(self):
+        return conn.stats()
+
 
 class Model(Resource):
     def get(self):
-        results = conn.execute("SELECT id, name, min_age, max_age FROM corelle.model")
-        return [dict(r) for r in results]
+        q = text("SELECT id, name, min_age, max_age FROM corelle.model")
+        return [dict(r._mapping) for r in conn.execute(q)]
 
 
 class Point(ModelResource):
@@ -187,21 +638,62 @@ class Point(ModelResource):
 
     def get(self):
         args = self.parser.parse_args()
-        points = args.data.split()
+        points = [p.split(",") for p in args.data.split()]
+        lon, lat = N.array(points, dtype=float).reshape(-1, 2).T
+        res = reconstruct_points(args["model"], lon, lat, float(args["time"]))
         out_points = []
-        for p in points:
-            [lon, lat] = p.split(",")
-            pt = [float(lon), float(lat)]
-            res = rotate_point(pt, args["model"], args["time"])
-            if res is not None:
-                res = dict(type="Feature", geometry=dict(type="Point", coordinates=res))
-                out_points.append(res)
-            else:
+        for x, y in zip(res["lon"], res["lat"]):
+            if N.isnan(x):
                 if args["include_failures"]:
                     out_points.append(None)
+                continue
+            geom = dict(type="Point", coordinates=[x, y])
+            out_points.append(dict(type="Feature", geometry=geom))
         return out_points
 
 
+def _nullable(values):
+    """Convert an array to a list, with NaN values as null"""
+    return [None if N.isnan(v) else v for v in values.tolist()]
+
+
+class ReconstructPoints(Resource):
+    """
+    Reconstruct many points in a single request. Accepts a JSON body with
+    `model`, `lon` and `lat` arrays and either a single `time` or an array
+    of per-point `ages`.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.parser = RequestParser()
+        self.parser.add_argument("model", type=str, required=True, location="json")
+        for arg in ("lon", "lat"):
+            self.parser.add_argument(
+                arg, type=float, action="append", required=True, location="json"
+            )
+        self.parser.add_argument("time", type=float, location="json")
+        self.parser.add_argument("ages", type=float, action="append", location="json")
+
+    def post(self):
+        args = self.parser.parse_args()
+        # Discard the model and plate index if the model has been re-imported
+        current_version(args["model"])
+        n = len(args["lon"])
+        time = args["ages"] if args["ages"] is not None else args["time"]
+        if time is None:
+            abort(400, message="Either `time` or `ages` must be provided")
+        if len(args["lat"]) != n or (args["ages"] is not None and len(time) != n):
+            abort(400, message="`lon`, `lat` and `ages` must have the same length")
+
+        res = reconstruct_points(args["model"], args["lon"], args["lat"], time)
+        return dict(
+            lon=_nullable(res["lon"]),
+            lat=_nullable(res["lat"]),
+            plate_id=[None if p < 0 else p for p in res["plate_id"].tolist()],
+        )
+
+
 class Reconstruct(ModelResource):
     """
     Resource to do plate reconstructions for Macrostrat... e.g.
@@ -218,10 +710,12 @@ class Reconstruct(ModelResource):
 
     def get(self):
         args = self.parser.parse_args()
-        pt = [args["lng"], args["lat"]]
-        out = rotate_point(pt, args["model"], args["age"])
-        if out is None:
+        res = reconstruct_points(
+            args["model"], [args["lng"]], [args["lat"]], args["age"]
+        )
+        if N.isnan(res["lon"][0]):
             return None
+        out = [res["lon"][0], res["lat"][0]]
         return dict(
             type="FeatureCollection",
             features=[
@@ -236,7 +730,15 @@ api.add_resource(Rotation, "/api/rotate")
 api.add_resource(RotationSeries, "/api/rotate-series")
 api.add_resource(AllFeatures, "/api/feature")
 api.add_resource(Features, "/api/feature/<string:dataset>")
+api.add_resource(
+    Reconstruction,
+    "/api/reconstruction/plates",
+    "/api/reconstruction/feature/<string:dataset>",
+)
 api.add_resource(Pole, "/api/pole")
 api.add_resource(Point, "/api/point")
+api.add_resource(ReconstructPoints, "/api/reconstruct-points")
 api.add_resource(Model, "/api/model")
 api.add_resource(Reconstruct, "/api/reconstruct")
+api.add_resource(CacheStats, "/api/cache")
+api.add_resource(PoolStats, "/api/pool")
@@ -0,0 +1,245 @@
+"""
+ASGI application for serving the Corelle API under concurrent load.
+
+Resources that only read from the database (feature datasets, plate polygons,
+cached reconstructions and the model list) are served by async handlers with
+an `asyncpg` connection pool, so slow queries don't hold up other requests.
+All other routes are passed to the Flask application, which runs in a pool of
+worker threads where rotations are computed. Routes and responses are the
+same as those of the Flask application.
+
+Run with `corelle serve --async`, or any ASGI server
+(e.g. `uvicorn corelle.server.asgi:app`).
+"""
+from contextlib import asynccontextmanager
+from decimal import Decimal
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from simplejson import dumps
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_accept_header
+
+from corelle.engine.database import conn_string, pool_options, env_int
+from corelle.engine.query import positional_sql
+from . import (
+    app as flask_app,
+    accepted_encodings,
+    cache_validators,
+    feature_query_params,
+    not_modified,
+    response_format,
+)
+
+# Threads that handle requests passed to the Flask application
+worker_threads = env_int("CORELLE_WORKER_THREADS", 10)
+flask_routes = WSGIMiddleware(flask_app, workers=worker_threads)
+
+_model_version = "SELECT version, updated FROM corelle.model WHERE name = $1"
+
+
+def _dsn(url):
+    # asyncpg doesn't understand SQLAlchemy driver names (e.g. `postgresql+psycopg2`)
+    _, rest = url.split("://", 1)
+    return "postgresql://" + rest
+
+
+@asynccontextmanager
+async def lifespan(app):
+    options = pool_options()
+    app.state.pool = await asyncpg.create_pool(
+        _dsn(conn_string),
+        min_size=1,
+        max_size=options["pool_size"] + options["max_overflow"],
+        max_inactive_connection_lifetime=options["pool_recycle"],
+    )
+    try:
+        yield
+    finally:
+        await app.state.pool.close()
+
+
+def _query(key, params):
+    sql, names = positional_sql(key)
+    return sql, [params[k] for k in names]
+
+
+def _json(data, status_code=200, headers=None):
+    return Response(
+        dumps(data),
+        status_code=status_code,
+        headers=headers,
+        media_type="application/json",
+    )
+
+
+def _error(status_code, message):
+    # The same format as errors from `flask_restful.abort`
+    return _json(dict(message=message), status_code=status_code)
+
+
+async def _validators(request, conn):
+    """Caching headers for a response, or a 304 response if the client's copy
+    is still valid (see `corelle.server.versioned`)"""
+    version = await conn.fetchrow(_model_version, request.query_params.get("model"))
+    if version is None:
+        return None, None
+    tag, headers = cache_validators(
+        request.url.path,
+        request.query_params.multi_items(),
+        version["version"],
+        version["updated"],
+        variant=response_format(
+            request.query_params.get("format"), request.headers.get("Accept")
+        ),
+    )
+    if not_modified(request.headers, tag, version["updated"]):
+        return headers, Response(status_code=304, headers=headers)
+    return headers, None
+
+
+async def _compressed(request, conn, key, params, headers):
+    """A stored, precompressed copy of a payload in an encoding that the
+    client accepts, or None (see `corelle.server.compressed_response`)"""
+    accept = parse_accept_header(request.headers.get("Accept-Encoding"))
+    encodings = accepted_encodings(accept)
+    if not encodings:
+        return None
+    sql, args = _query(key, dict(params, encodings=encodings))
+    res = await conn.fetchrow(sql, *args)
+    if res is None:
+        return None
+    headers = {**(headers or {}), "Content-Encoding": res["encoding"]}
+    return Response(res["data"], headers=headers, media_type="application/json")
+
+
+def _model_param(request):
+    model = request.query_params.get("model")
+    if model is None:
+        return None, _error(400, dict(model="Missing required parameter"))
+    return model, None
+
+
+async def all_features(request):
+    sql = "SELECT DISTINCT dataset_id FROM corelle.feature_cache"
+    async with request.app.state.pool.acquire() as conn:
+        return _json([r[0] for r in await conn.fetch(sql)])
+
+
+async def models(request):
+    sql = "SELECT id, name, min_age, max_age FROM corelle.model"
+    async with request.app.state.pool.acquire() as conn:
+        return _json([dict(r) for r in await conn.fetch(sql)])
+
+
+async def modern_plates(request):
+    model, error = _model_param(request)
+    if error is not None:
+        return error
+    if "time" in request.query_params or "tolerance" in request.query_params:
+        # Reconstructed plates need the rotation engine, so they are passed to
+        # the Flask application (any ASGI application can be a response)
+        return flask_routes
+    async with request.app.state.pool.acquire() as conn:
+        headers, cached = await _validators(request, conn)
+        if cached is not None:
+            return cached
+        params = dict(model_name=model)
+        compressed = await _compressed(
+            request, conn, "modern-plate-polygons-compressed", params, headers
+        )
+        if compressed is not None:
+            return compressed
+        sql, args = _query("modern-plate-polygons-cached", params)
+        res = await conn.fetchval(sql, *args)
+    return Response(
+        "null" if res is None else res, headers=headers, media_type="application/json"
+    )
+
+
+async def reconstruction(request):
+    model, error = _model_param(request)
+    if error is not None:
+        return error
+    try:
+        time = float(request.query_params["time"])
+    except (KeyError, ValueError):
+        return _error(400, dict(time="Missing required parameter"))
+    dataset = request.path_params.get("dataset")
+    params = dict(
+        model_name=model,
+        layer="plates" if dataset is None else "features",
+        dataset_id=dataset or "",
+        time=Decimal(repr(time)),
+    )
+    async with request.app.state.pool.acquire() as conn:
+        headers, cached = await _validators(request, conn)
+        if cached is not None:
+            return cached
+        compressed = await _compressed(
+            request, conn, "reconstruction-compressed", params, headers
+        )
+        if compressed is not None:
+            return compressed
+        sql, args = _query("reconstruction-cached", params)
+        res = await conn.fetchval(sql, *args)
+    if res is None:
+        return _error(404, f"No reconstruction is cached for {time} Ma")
+    return Response(res, headers=headers, media_type="application/json")
+
+
+async def features(request):
+    model, error = _model_param(request)
+    if error is not None:
+        return error
+    args = request.query_params
+    try:
+        params = feature_query_params(
+            request.path_params["dataset"],
+            model=model,
+            bbox=args.get("bbox"),
+            plate_id=[int(v) for v in args.getlist("plate_id")] or None,
+            page=int(args.get("page", 0)),
+            page_size=None if args.get("page_size") is None else int(args["page_size"]),
+        )
+    except ValueError as err:
+        return _error(400, str(err))
+
+    pool = request.app.state.pool
+    async with pool.acquire() as conn:
+        headers, cached = await _validators(request, conn)
+    if cached is not None:
+        return cached
+
+    async def stream(batch_size=1000):
+        # A cursor streams features without holding the dataset in memory
+        sql, args = _query("feature-dataset-cached", params)
+        sep = "["
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                cursor = await conn.cursor(sql, *args)
+                while True:
+                    rows = await cursor.fetch(batch_size)
+                    if not rows:
+                        break
+                    yield sep + ",".join(r[0] for r in rows)
+                    sep = ","
+        yield "[]" if sep == "[" else "]"
+
+    return StreamingResponse(stream(), headers=headers, media_type="application/json")
+
+
+routes = [
+    Route("/api/plates", modern_plates),
+    Route("/api/feature", all_features),
+    Route("/api/feature/{dataset}", features),
+    Route("/api/reconstruction/plates", reconstruction),
+    Route("/api/reconstruction/feature/{dataset}", reconstruction),
+    Route("/api/model", models),
+    # Everything else is handled by the Flask application
+    Mount("/", app=flask_routes),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan)
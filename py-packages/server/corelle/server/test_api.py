@@ -1,7 +1,15 @@
-from pytest import fixture
+from gzip import decompress
+
+from pytest import fixture, importorskip
 from numpy import allclose
+from simplejson import loads
+from sqlalchemy import text
 
-from corelle.client import rotate_features
+from corelle.client import read_rotations, rotate_features
+from corelle.engine.cache import build_reconstruction_caches
+from corelle.engine.model import get_rotation_model
+from corelle.engine.storage import bump_model_version, conn, model_id
+import corelle.server as server
 from . import app
 
 
@@ -11,6 +19,29 @@ def client():
         yield client
 
 
+_count_reconstructions = text(
+    "SELECT count(*) FROM corelle.reconstruction_cache WHERE model_id = :model_id"
+)
+_delete_reconstructions = text(
+    "DELETE FROM corelle.reconstruction_cache WHERE model_id = :model_id"
+)
+
+
+@fixture(scope="module")
+def reconstructions():
+    """Seton2012's cached reconstructions, which aren't built when the starter
+    data is imported. They are removed afterwards unless they already existed."""
+    params = dict(model_id=model_id("Seton2012"))
+    built = conn.execute(_count_reconstructions, params).scalar() == 0
+    if built:
+        build_reconstruction_caches(["Seton2012"])
+    yield
+    if built:
+        conn.execute(_delete_reconstructions, params)
+        conn.commit()
+        bump_model_version(params["model_id"])
+
+
 def test_basic_api_access(client):
     rotations = client.get("/api/rotate?model=Wright2013&time=120&quaternion=true").json
     # API call returns GeoJSON format plates
@@ -35,3 +66,177 @@ def test_reconstruct_api(client):
     assert len(res["features"]) == 1
     coords = res["features"][0]["geometry"]["coordinates"]
     assert allclose(coords, [-84.17949814030625, -21.341188167880905])
+
+
+def test_reconstruct_points_api(client):
+    """Batch reconstruction should agree with single-point reconstruction"""
+    body = dict(
+        model="Scotese",
+        lon=[-89.37088151960317, 0, 20],
+        lat=[43.084235832279795, -89.9, 10],
+        ages=[500, 100, 0],
+    )
+    res = client.post("/api/reconstruct-points", json=body).json
+    assert len(res["lon"]) == 3
+    assert allclose(
+        [res["lon"][0], res["lat"][0]], [-84.17949814030625, -21.341188167880905]
+    )
+    # Points at the present day are returned unchanged
+    assert allclose([res["lon"][2], res["lat"][2]], [20, 10])
+
+
+def test_reconstruct_points_requires_time(client):
+    body = dict(model="Scotese", lon=[0], lat=[0])
+    res = client.post("/api/reconstruct-points", json=body)
+    assert res.status_code == 400
+
+
+def test_pole_api(client):
+    url = "/api/pole?model=Seton2012&plate_id=701&time_start=0&time_end=100&interval=10"
+    steps = client.get(url).json
+    assert [s["t_step"] for s in steps] == list(range(0, 100, 10))
+    res = client.get(url + "&compact=true").json
+    assert res["t_step"] == [s["t_step"] for s in steps]
+    assert allclose(res["angle"], [s["angle"] for s in steps])
+    assert client.get(url + "&compact=false").json == steps
+
+
+def test_feature_api(client):
+    url = "/api/feature/ne_110m_land?model=Seton2012"
+    features = client.get(url).json
+    assert len(features) > 10
+    # Pages of features are in a consistent order
+    page = client.get(url + "&page=1&page_size=5").json
+    assert page == features[5:10]
+    assert client.get(url + "&page=1").status_code == 400
+    plate_id = features[0]["properties"]["plate_id"]
+    res = client.get(url + f"&plate_id={plate_id}").json
+    assert all(f["properties"]["plate_id"] == plate_id for f in res)
+    res = client.get(url + "&bbox=-10,40,10,60").json
+    assert 0 < len(res) < len(features)
+
+
+def test_point_lookup_is_prepared(client):
+    # Keep the request's connection open, so that its statements can be checked
+    with app.app_context():
+        res = client.get("/api/point?model=Seton2012&time=100&data=10,50")
+        assert res.status_code == 200
+        assert "plates-for-points" in conn.info["prepared_statements"]
+
+
+def test_reconstruction_api(client, reconstructions):
+    url = "/api/reconstruction/plates?model=Seton2012&time="
+    plates = client.get(url + "0").json
+    assert len(plates) > 10
+    assert all(p["type"] == "Feature" for p in plates)
+    assert client.get(url + "0.5").status_code == 404
+
+
+def test_conditional_requests(client):
+    url = "/api/rotate?model=Seton2012&time=100"
+    res = client.get(url)
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    assert "max-age" in res.headers["Cache-Control"]
+    res = client.get(url, headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    # Different parameters have different validators
+    res = client.get(url + "&quaternion=true", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+
+
+def test_async_api(client):
+    """The ASGI application serves the same responses as the Flask application"""
+    importorskip("asyncpg")
+    from starlette.testclient import TestClient
+    from .asgi import app as asgi_app
+
+    with TestClient(asgi_app) as async_client:
+        for url in [
+            "/api/plates?model=Seton2012",
+            "/api/feature/ne_110m_land?model=Seton2012&page=1&page_size=5",
+            "/api/rotate?model=Seton2012&time=100",
+        ]:
+            res = async_client.get(url)
+            assert res.status_code == 200
+            assert res.json() == client.get(url).json
+            assert res.headers["ETag"] == client.get(url).headers["ETag"]
+
+
+def test_rotation_series_ndjson(client):
+    url = "/api/rotate-series?model=Seton2012&time_start=100&time_end=0&interval=10"
+    steps = client.get(url).json
+    res = client.get(url, headers={"Accept": "application/x-ndjson"})
+    assert res.mimetype == "application/x-ndjson"
+    lines = [loads(line) for line in res.data.decode("utf-8").splitlines()]
+    assert lines == steps
+    assert res.headers["ETag"] != client.get(url).headers["ETag"]
+
+
+def test_binary_rotations(client):
+    url = "/api/rotate-series?model=Seton2012&time_start=20&time_end=0&interval=10"
+    steps = client.get(url + "&quaternion=true").json
+    res = client.get(url + "&format=npy")
+    assert res.mimetype == "application/x-npy"
+    rotations = read_rotations(res.data)
+    assert sorted(set(rotations["time"])) == [10, 20]
+    for step in steps:
+        records = rotations[rotations["time"] == step["time"]]
+        assert list(records["plate_id"]) == [r["plate_id"] for r in step["rotations"]]
+        assert allclose(
+            records["quaternion"], [r["quaternion"] for r in step["rotations"]]
+        )
+
+    res = client.get(
+        "/api/rotate?model=Seton2012&time=10&precision=32",
+        headers={"Accept": "application/x-npy"},
+    )
+    rotations = read_rotations(res.data)
+    assert rotations.dtype["quaternion"].base == "<f4"
+    assert allclose(rotations["time"], 10)
+
+
+def test_compressed_payloads(client):
+    # Payloads are compressed when the model is imported
+    url = "/api/plates?model=Seton2012"
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in plain.headers
+    res = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert loads(decompress(res.data)) == plain.json
+
+
+def test_reconstructed_plates(client):
+    modern = client.get("/api/plates?model=Seton2012").json
+    res = client.get("/api/plates?model=Seton2012&time=50").json
+    assert 0 < len(res) <= len(modern)
+    for feature in res:
+        props = feature["properties"]
+        assert props["young_lim"] <= 50
+        assert props["old_lim"] is None or props["old_lim"] > 50
+
+    simplified = client.get("/api/plates?model=Seton2012&tolerance=1").json
+    ids = {f["properties"]["id"] for f in modern}
+    assert {f["properties"]["id"] for f in simplified} == ids
+
+    res = client.get("/api/plates?model=Seton2012&tolerance=-1")
+    assert res.status_code == 400
+
+
+def test_stale_model_is_reloaded(client):
+    # A model loaded before it was re-imported (e.g. by an unversioned request)
+    model = get_rotation_model("Seton2012")
+    model.version -= 1
+    client.get("/api/rotate?model=Seton2012&time=10")
+    reloaded = get_rotation_model("Seton2012")
+    assert reloaded is not model
+    assert reloaded.version == model.version + 1
+
+
+def test_model_version_is_reused(client, monkeypatch):
+    """The version stamp isn't read from the database on every request"""
+    client.get("/api/rotate?model=Seton2012&time=10")
+    calls = []
+    monkeypatch.setattr(server, "model_version", lambda name: calls.append(name))
+    client.get("/api/rotate?model=Seton2012&time=20")
+    assert calls == []